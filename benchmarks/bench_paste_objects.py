@@ -0,0 +1,90 @@
+#  ***** BEGIN GPL LICENSE BLOCK *****
+#
+#  This program is free software: you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation, either version 3 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  ***** END GPL LICENSE BLOCK *****
+
+# Times copy/paste of many objects (every 10th object is a parent
+# of the next 9). The addon must be enabled. Run with the UI, since
+# the operators need a 3D view:
+#   blender --factory-startup --python benchmarks/bench_paste_objects.py
+# Blender quits when done (paste leaves a modal transform running).
+
+import time
+import random
+
+import bpy
+
+counts = (1000, 10000)
+
+def find_view3d(context):
+    for area in context.screen.areas:
+        if area.type != 'VIEW_3D': continue
+        for region in area.regions:
+            if region.type == 'WINDOW':
+                override = context.copy()
+                override.update(area=area, region=region, space_data=area.spaces.active,
+                                region_data=area.spaces.active.region_3d)
+                return override
+    raise RuntimeError("No 3D view found")
+
+def addon_preferences(context):
+    for name, addon in context.user_preferences.addons.items():
+        if "cut_copy_paste" in name:
+            return addon.preferences
+    raise RuntimeError("Cut/Copy/Paste addon isn't enabled")
+
+def make_objects(scene, count):
+    for obj in list(scene.objects):
+        scene.objects.unlink(obj)
+    
+    mesh = bpy.data.meshes.new("BenchMesh")
+    mesh.from_pydata([(0, 0, 0), (1, 0, 0), (0, 1, 0)], [], [(0, 1, 2)])
+    
+    rnd = random.Random(0)
+    parent = None
+    for i in range(count):
+        obj = bpy.data.objects.new("Bench.%d" % i, mesh)
+        obj.location = (rnd.uniform(-100, 100), rnd.uniform(-100, 100), rnd.uniform(-100, 100))
+        obj.rotation_euler = (rnd.random(), rnd.random(), rnd.random())
+        if i % 10 == 0:
+            parent = obj
+        else:
+            obj.parent = parent
+        scene.objects.link(obj)
+        obj.select = True
+    
+    scene.update()
+
+def main():
+    context = bpy.context
+    override = find_view3d(context)
+    
+    opts = addon_preferences(context)
+    opts.move_to_mouse = False # no mouse event in EXEC mode
+    
+    for count in counts:
+        make_objects(context.scene, count)
+        
+        t0 = time.perf_counter()
+        bpy.ops.view3d.copy(override)
+        t1 = time.perf_counter()
+        bpy.ops.view3d.paste(override, 'EXEC_DEFAULT')
+        t2 = time.perf_counter()
+        
+        print("{} objects: copy {:.3f} s, paste {:.3f} s".format(count, t1 - t0, t2 - t1))
+    
+    bpy.ops.wm.quit_blender()
+
+main()
@@ -43,15 +43,35 @@ from bpy_extras.view3d_utils import (region_2d_to_vector_3d,
 
 import os
 import shutil
-import glob
 import time
 import json
 import bz2
+import zlib
 import base64
+import hashlib
 import struct
 import io
+import sys
+import mmap
+import gzip
+import threading
+import tempfile
+import operator
 
+from array import array
+from itertools import compress, chain, accumulate
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
 
 try:
     import dairin0d
@@ -108,71 +128,160 @@ def get_clipboards_dir():
     clipboards_path = os.path.normcase(os.path.join(blender_tempdir, "blender_clipboards"))
     return clipboards_path
 
-def compress_b64(b):
-    # Somewhat strangely, compresslevel=1 not just works twice as fast
-    # than compresslevel=9, but also results in lower size %)
-    # (Tested on Suzanne subsurfed 3 times)
-    return base64.b64encode(bz2.compress(b, 1)).decode('ascii')
+class Codec:
+    def __init__(self, compress, decompress, compressor):
+        self.compress = compress
+        self.decompress = decompress
+        self.compressor = compressor # incremental compressor factory
+
+# Codec name is stored in the clipboard JSON; older versions
+# of the addon always used bz2, so it's the default on reading.
+codecs = {}
+codecs["none"] = Codec(bytes, bytes, (lambda: None))
+# Level 1 is much faster and (for this kind of data) not much worse
+codecs["zlib"] = Codec((lambda b: zlib.compress(b, 1)), zlib.decompress,
+                       (lambda: zlib.compressobj(1)))
+if lzma:
+    codecs["lzma"] = Codec((lambda b: lzma.compress(b, preset=0)), lzma.decompress,
+                           (lambda: lzma.LZMACompressor(preset=0)))
+# Somewhat strangely, compresslevel=1 not just works twice as fast
+# than compresslevel=9, but also results in lower size %)
+# (Tested on Suzanne subsurfed 3 times)
+codecs["bz2"] = Codec((lambda b: bz2.compress(b, 1)), bz2.decompress,
+                      (lambda: bz2.BZ2Compressor(1)))
+
+# (max size, codec) for the "auto" mode: small payloads aren't worth
+# compressing, medium ones get the best ratio and big ones the best speed
+codec_auto_sizes = [(16*1024, "none"), (1024*1024, "lzma"), (None, "zlib")]
+
+def resolve_codec(name, size=None):
+    if name == "auto":
+        if size is None: # unknown in advance when streaming
+            return codec_auto_sizes[-1][1]
+        for max_size, name in codec_auto_sizes:
+            if (max_size is None) or (size <= max_size):
+                break
+    if name not in codecs: name = "zlib"
+    return name
+
+def compress_b64(b, codec="bz2"):
+    return base64.b64encode(codecs[codec].compress(b)).decode('ascii')
+
+def decompress_b64(c, codec="bz2"):
+    return codecs[codec].decompress(base64.b64decode(c.encode('ascii')))
+
+# Versions of the "Blender 3D-clipboard" format:
+# 1 - per-element big-endian records
+# 2 - mesh geometry is stored as little-endian columns (one chunk per
+#     attribute, see write_column()), so whole columns can be read via
+#     array.frombytes() / numpy.frombuffer() without per-element unpacking
+clipboard_versions = {1, 2}
+clipboard_version = 2
 
-def decompress_b64(c):
-    return bz2.decompress(base64.b64decode(c.encode('ascii')))
+# Precompiled records of the per-element (big-endian) encoding.
+# All fields of an element are fused into one record, so that
+# (de)serializing an element takes a single pack/unpack call.
+records = {
+    "H":struct.Struct('!H'),
+    "I":struct.Struct('!I'),
+    "i":struct.Struct('!i'),
+    "f":struct.Struct('!f'),
+    "d":struct.Struct('!d'),
+    "B":struct.Struct('!B'),
+    "bool":struct.Struct('!?'),
+    "ddd":struct.Struct('!ddd'),
+    "fff":struct.Struct('!fff'),
+    "deform_item":struct.Struct('!if'), # group index, weight
+    "uv":struct.Struct('!?ff'), # pin_uv, uv
+    "skin":struct.Struct('!ff??'), # radius, use_loose, use_root
+}
 
 def def_read_funcs(_stream):
     read = _stream.read
     unpack = struct.unpack
     
+    # For buffer streams, records are unpacked right from the buffer
+    def _reader(_record):
+        _size = _record.size
+        if isinstance(_stream, BufferStream):
+            _buffer = _stream.buffer
+            _unpack_from = _record.unpack_from
+            def read_record():
+                pos = _stream.pos
+                _stream.pos = pos + _size
+                return _unpack_from(_buffer, pos)
+        else:
+            _unpack = _record.unpack
+            def read_record():
+                return _unpack(read(_size))
+        return read_record
+    
+    _read_H = _reader(records["H"])
+    _read_I = _reader(records["I"])
+    _read_i = _reader(records["i"])
+    _read_f = _reader(records["f"])
+    _read_d = _reader(records["d"])
+    _read_B = _reader(records["B"])
+    _read_bool = _reader(records["bool"])
+    _read_ddd = _reader(records["ddd"])
+    _read_fff = _reader(records["fff"])
+    _read_uv = _reader(records["uv"])
+    _read_skin = _reader(records["skin"])
+    _iter_unpack_deform = records["deform_item"].iter_unpack
+    
     def read_H():
-        return unpack('!H', read(2))[0]
+        return _read_H()[0]
     
     def read_I():
-        return unpack('!I', read(4))[0]
+        return _read_I()[0]
     
     def read_i():
-        return unpack('!i', read(4))[0]
+        return _read_i()[0]
     
     def read_f():
-        return unpack('!f', read(4))[0]
+        return _read_f()[0]
     
     def read_d():
-        return unpack('!d', read(8))[0]
+        return _read_d()[0]
     
     def read_bool():
-        return unpack('!?', read(1))[0]
+        return _read_bool()[0]
     
     def read_ddd():
-        return unpack('!ddd', read(24))
+        return _read_ddd()
     
     def read_str():
-        return read(read_H()).decode('utf-8')
+        return str(read(_read_H()[0]), 'utf-8')
     
     def deserializer_float(elem, layer):
-        elem[layer] = unpack('!f', read(4))[0]
+        elem[layer] = _read_f()[0]
     
     def deserializer_int(elem, layer):
-        elem[layer] = unpack('!i', read(4))[0]
+        elem[layer] = _read_i()[0]
     
     def deserializer_string(elem, layer):
         # string layer is exposed as bytes, max len is 255
-        elem[layer] = read(unpack('!B', read(1))[0])
+        elem[layer] = bytes(read(_read_B()[0]))
     
     def deserializer_deform(elem, layer):
         dvert = elem[layer]
+        count = _read_i()[0]
+        items = read(count * 8)
         if not hasattr(dvert, "items"): return # Blender supports this since some version
-        count = unpack('!i', read(4))[0]
-        for i in range(count):
-            group_index = unpack('!i', read(4))[0]
-            weight = unpack('!f', read(4))[0]
+        for group_index, weight in _iter_unpack_deform(items):
             dvert[group_index] = weight
     
     def deserializer_vector(elem, layer):
-        elem[layer] = unpack('!ddd', read(24))
+        elem[layer] = _read_ddd()
     
     def deserializer_color(elem, layer):
-        elem[layer] = unpack('!fff', read(12))
+        elem[layer] = _read_fff()
     
     def deserializer_uv(elem, layer):
-        elem[layer].pin_uv = unpack('!?', read(1))[0]
-        elem[layer].uv = unpack('!ff', read(8))
+        pin_uv, u, v = _read_uv()
+        item = elem[layer]
+        item.pin_uv = pin_uv
+        item.uv = (u, v)
     
     def deserializer_tex(elem, layer):
         facetex = elem[layer]
@@ -182,15 +291,17 @@ def def_read_funcs(_stream):
             pass # TODO
     
     def deserializer_skin(elem, layer):
-        elem[layer].radius = unpack('!ff', read(8))
-        elem[layer].use_loose = unpack('!?', read(1))[0]
-        elem[layer].use_root = unpack('!?', read(1))[0]
+        radius_x, radius_y, use_loose, use_root = _read_skin()
+        item = elem[layer]
+        item.radius = (radius_x, radius_y)
+        item.use_loose = use_loose
+        item.use_root = use_root
     
     def deserializer_freestyle(elem, layer):
         pass # Not implemented as of Blender 2.74
     
     def deserializer_paint_mask(elem, layer):
-        elem[layer].value = unpack('!f', read(4))[0]
+        elem[layer].value = _read_f()[0]
     
     return {k:v for k, v in locals().items() if not k.startswith("_")}
 
@@ -198,41 +309,47 @@ def def_write_funcs(_stream):
     write = _stream.write
     pack = struct.pack
     
+    _pack_H = records["H"].pack
+    _pack_i = records["i"].pack
+    _pack_f = records["f"].pack
+    _pack_B = records["B"].pack
+    _pack_ddd = records["ddd"].pack
+    _pack_fff = records["fff"].pack
+    _pack_uv = records["uv"].pack
+    _pack_skin = records["skin"].pack
+    _pack_deform_item = records["deform_item"].pack
+    _deform_empty = _pack_i(0)
+    
     def write_str(s):
         b = s.encode('utf-8')
-        write(pack('!H', len(b)))
-        write(b)
+        write(_pack_H(len(b)) + b)
     
     def serializer_float(value):
-        write(pack('!f', value))
+        write(_pack_f(value))
     
     def serializer_int(value):
-        write(pack('!i', value))
+        write(_pack_i(value))
     
     def serializer_string(value):
         # string layer is exposed as bytes, max len is 255
-        write(pack('!B', len(value)))
-        write(value)
+        write(_pack_B(len(value)) + value)
     
     def serializer_deform(value):
         if not hasattr(value, "items"):
-            write(pack('!i', 0)) # Blender supports this since some version
+            write(_deform_empty) # Blender supports this since some version
         else:
             items = value.items()
-            write(pack('!i', len(items)))
-            for group_index, weight in items:
-                write(pack('!i', group_index))
-                write(pack('!f', weight))
+            write(_pack_i(len(items)) + b"".join(_pack_deform_item(group_index, weight)
+                                                  for group_index, weight in items))
     
     def serializer_vector(value):
-        write(pack('!ddd', *value))
+        write(_pack_ddd(*value))
     
     def serializer_color(value):
-        write(pack('!fff', *value))
+        write(_pack_fff(*value))
     
     def serializer_uv(value):
-        write(pack('!?', value.pin_uv))
-        write(pack('!ff', *value.uv))
+        write(_pack_uv(value.pin_uv, *value.uv))
     
     def serializer_tex(value):
         if not hasattr(value, "image"):
@@ -241,18 +358,21 @@ def def_write_funcs(_stream):
             pass # TODO
     
     def serializer_skin(value):
-        write(pack('!ff', *value.radius))
-        write(pack('!?', value.use_loose))
-        write(pack('!?', value.use_root))
+        write(_pack_skin(value.radius[0], value.radius[1], value.use_loose, value.use_root))
     
     def serializer_freestyle(value):
         pass # Not implemented as of Blender 2.74
     
     def serializer_paint_mask(value):
-        write(pack('!f', value.value))
+        write(_pack_f(value.value))
     
     return {k:v for k, v in locals().items() if not k.startswith("_")}
 
+# Size of a chunk written to a non-seekable stream; the actual
+# size is looked up in the index at the end of the data
+chunk_size_unknown = 0xFFFFFFFF
+chunk_index_magic = b"CHUNKIDX"
+
 class ChunkWriter:
     def __init__(self, stream, name):
         self.stream = stream
@@ -262,7 +382,8 @@ class ChunkWriter:
         stream.write(b)
         
         self.size_pos = stream.tell()
-        stream.write(struct.pack('!I', 0))
+        self.streaming = isinstance(stream, ChunkStream)
+        stream.write(struct.pack('!I', (chunk_size_unknown if self.streaming else 0)))
         
         self.pos = stream.tell()
     
@@ -271,10 +392,111 @@ class ChunkWriter:
     
     def __exit__(self, type, value, traceback):
         pos = self.stream.tell()
+        if self.streaming:
+            self.stream.chunk_sizes.append(self.size_pos)
+            self.stream.chunk_sizes.append(pos - self.pos)
+            return
         self.stream.seek(self.size_pos)
         self.stream.write(struct.pack('!I', pos - self.pos))
         self.stream.seek(pos)
 
+class ChunkStream:
+    # A write-only stream that passes the data straight to the output
+    # (through an incremental compressor, if any). Since it can't seek,
+    # chunk sizes are appended as an index at the end:
+    # (size position, size) pairs, number of pairs, chunk_index_magic.
+    def __init__(self, output, compressor=None):
+        self.output = output
+        self.compressor = compressor
+        self.pos = 0
+        self.chunk_sizes = array('I')
+    
+    def write(self, b):
+        self.pos += len(b)
+        if self.compressor: b = self.compressor.compress(b)
+        if b: self.output.write(b)
+    
+    def tell(self):
+        return self.pos
+    
+    def close(self):
+        if self.chunk_sizes is None: return
+        index = self.chunk_sizes
+        self.chunk_sizes = None
+        self.write(array_bytes(index, 'little'))
+        self.write(struct.pack('<I', len(index) // 2) + chunk_index_magic)
+        if self.compressor: self.output.write(self.compressor.flush())
+
+def read_chunk_index(buffer):
+    # Returns (size position -> size, data length without the index)
+    tail_size = 4 + len(chunk_index_magic)
+    if (len(buffer) < tail_size) or (buffer[-len(chunk_index_magic):] != chunk_index_magic):
+        return None, len(buffer)
+    end = len(buffer) - tail_size
+    count = struct.unpack('<I', buffer[end:end+4])[0]
+    start = end - count * 8
+    index = array_from_bytes('I', buffer[start:end], 'little')
+    return dict(zip(index[0::2], index[1::2])), start
+
+def map_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b"" # empty files can't be mapped
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+class BufferStream:
+    # A read-only stream over a buffer (e.g. a memory-mapped file).
+    # read() returns memoryview slices, so no data is copied and
+    # reading fields is mere offset arithmetic (no syscalls).
+    def __init__(self, buffer, chunk_index=False):
+        self.source = buffer
+        self.buffer = memoryview(buffer).cast('B')
+        self.pos = 0
+        
+        # Data written via ChunkStream ends with chunk index
+        # (the clipboard JSON tells whether it does)
+        self.chunk_sizes = None
+        if chunk_index:
+            self.chunk_sizes, size = read_chunk_index(self.buffer)
+            self.buffer = self.buffer[:size]
+    
+    @classmethod
+    def open(cls, path, chunk_index=False):
+        return cls(map_file(path), chunk_index)
+    
+    def read(self, size=-1):
+        start = self.pos
+        end = len(self.buffer)
+        if (size is not None) and (size >= 0):
+            end = min(start + size, end)
+        self.pos = max(start, end)
+        return self.buffer[start:end]
+    
+    def seek(self, pos, whence=0):
+        if whence == 1:
+            pos += self.pos
+        elif whence == 2:
+            pos += len(self.buffer)
+        self.pos = max(pos, 0)
+        return self.pos
+    
+    def tell(self):
+        return self.pos
+    
+    def close(self):
+        self.buffer.release()
+        if isinstance(self.source, mmap.mmap):
+            try:
+                self.source.close()
+            except BufferError:
+                pass # some slices are still alive; will be closed by GC
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, type, value, traceback):
+        self.close()
+
 class ChunkReader:
     def __init__(self, stream, expected_name=None):
         self.stream = stream
@@ -294,12 +516,15 @@ class ChunkReader:
             self.end = stream.tell()
             return
         
-        self.name = read(n).decode('utf-8')
+        self.name = str(read(n), 'utf-8')
         
         if expected_name:
             assert self.name == expected_name
         
+        size_pos = stream.tell()
         self.size = unpack('!I', read(4))[0]
+        if self.size == chunk_size_unknown:
+            self.size = stream.chunk_sizes[size_pos]
         
         self.end = stream.tell() + self.size
     
@@ -315,6 +540,552 @@ class ChunkReader:
     def skip(self):
         self.stream.seek(self.end)
 
+column_typecodes = set("bBhHiIfd")
+
+def write_column(stream, name, a, size=1):
+    # Header: typecode, number of components, number of elements
+    with ChunkWriter(stream, name):
+        stream.write(struct.pack('<cBI', a.typecode.encode('ascii'), size, len(a) // size))
+        stream.write(array_bytes(a, 'little'))
+
+def read_column(stream, expected_name=None):
+    with ChunkReader(stream, expected_name) as chunk:
+        return _read_column_data(stream, chunk)
+
+def read_columns(stream, parent_chunk):
+    # all (remaining) columns of the parent chunk, by name
+    columns = {}
+    while parent_chunk:
+        with ChunkReader(stream) as chunk:
+            columns[chunk.name] = _read_column_data(stream, chunk)
+    return columns
+
+def _read_column_data(stream, chunk):
+    typecode, size, count = struct.unpack('<cBI', stream.read(6))
+    typecode = typecode.decode('ascii')
+    assert typecode in column_typecodes
+    a = array_from_bytes(typecode, stream.read(chunk.size - 6), 'little')
+    assert len(a) == count * size
+    return a
+
+# array module has no half-float type, so halves are kept as 'H'
+def array_to_half(a):
+    if numpy: return array('H', _np(a).astype(numpy.float16).tobytes())
+    return array('H', struct.pack('=%de' % len(a), *a))
+
+def array_from_half(a):
+    if numpy: return _from_np('f', _np(a).view(numpy.float16))
+    return array('f', struct.unpack('=%de' % len(a), a.tobytes()))
+
+# Vertex weights (v2) are stored in CSR form: the groups/weights of
+# i-th vertex are groups[offsets[i]:offsets[i+1]], weights[...]
+def write_deform_csr(stream, verts, layer, quantize=False):
+    # bmesh has no bulk access to deform weights, so each vertex's
+    # items() are read once; the columns are built from the flat pairs
+    dverts = [v[layer] for v in verts]
+    if dverts and hasattr(dverts[0], "items"): # Blender supports this since some version
+        items = [dvert.items() for dvert in dverts]
+    else:
+        items = [()] * len(dverts)
+    offsets = array('I', accumulate(chain((0,), map(len, items))))
+    pairs = tuple(zip(*chain.from_iterable(items))) or ((), ())
+    groups = array('I', pairs[0])
+    weights = array('f', pairs[1])
+    
+    write_column(stream, "offsets", offsets)
+    write_column(stream, "groups", groups)
+    if quantize:
+        write_column(stream, "weights_half", array_to_half(weights))
+    else:
+        write_column(stream, "weights", weights)
+
+def read_deform_csr(stream, chunk):
+    columns = read_columns(stream, chunk)
+    offsets = columns["offsets"]
+    groups = columns["groups"]
+    if "weights_half" in columns:
+        weights = array_from_half(columns["weights_half"])
+    else:
+        weights = columns["weights"]
+    assert len(groups) == len(weights) == (offsets[-1] if offsets else 0)
+    return offsets, groups, weights
+
+# foreach_get/foreach_set accept any object supporting the buffer
+# protocol, which is orders of magnitude faster than per-element access.
+# Arrays are kept as array.array throughout; NumPy (if available) is
+# only used to speed up the bulk arithmetic on them.
+
+def _np(a):
+    if not a: return numpy.zeros(0, a.typecode)
+    return numpy.frombuffer(a, a.typecode)
+
+def _from_np(typecode, a):
+    return array(typecode, a.astype(typecode).tobytes())
+
+def bulk_get(seq, attr, typecode, size=1):
+    buf = array(typecode, [0]) * (len(seq) * size)
+    if buf: seq.foreach_get(attr, buf)
+    return buf
+
+def array_cast(a, typecode):
+    if a.typecode == typecode: return a
+    if numpy: return _from_np(typecode, _np(a))
+    return array(typecode, a)
+
+def array_not(a):
+    if numpy: return _from_np('B', _np(a) == 0)
+    return array('B', [not v for v in a])
+
+def array_compress(a, mask, size=1):
+    if numpy:
+        return _from_np(a.typecode, _np(a).reshape(-1, size)[_np(mask) != 0])
+    if size != 1:
+        mask = [m for m in mask for i in range(size)]
+    return array(a.typecode, compress(a, mask))
+
+def array_take(a, indices, size=1):
+    if numpy: return _from_np(a.typecode, _np(a).reshape(-1, size)[_np(indices)])
+    if size != 1:
+        return array(a.typecode, [v for i in indices for v in a[i*size:i*size+size]])
+    return array(a.typecode, [a[i] for i in indices])
+
+def array_repeat(a, counts):
+    if numpy: return _from_np(a.typecode, numpy.repeat(_np(a), _np(counts)))
+    result = array(a.typecode)
+    for v, n in zip(a, counts):
+        result.extend(array(a.typecode, [v]) * n)
+    return result
+
+def array_trim(a, size, new_size):
+    # keep only the first new_size components of each element
+    if numpy: return _from_np(a.typecode, _np(a).reshape(-1, size)[:, :new_size])
+    return array(a.typecode, [v for i in range(0, len(a), size) for v in a[i:i+new_size]])
+
+def array_remap(mask):
+    # old index -> new index of the kept elements (-1 for the removed ones)
+    if numpy:
+        m = (_np(mask) != 0)
+        remap = numpy.full(len(m), -1, 'i')
+        remap[m] = numpy.arange(int(m.sum()), dtype='i')
+        return _from_np('i', remap)
+    remap = array('i', [-1]) * len(mask)
+    for i, j in enumerate(compress(range(len(mask)), mask)):
+        remap[j] = i
+    return remap
+
+def array_scatter(size, indices):
+    # mask of the given size with the elements at indices set
+    if numpy:
+        mask = numpy.zeros(size, 'B')
+        mask[_np(indices)] = 1
+        return _from_np('B', mask)
+    mask = array('B', [0]) * size
+    for i in indices:
+        mask[i] = 1
+    return mask
+
+def array_and_not(a, b):
+    # elementwise (a and not b)
+    if numpy: return _from_np('B', (_np(a) != 0) & (_np(b) == 0))
+    return array('B', [(v0 and not v1) for v0, v1 in zip(a, b)])
+
+def array_indices(mask):
+    if numpy: return _from_np('i', numpy.flatnonzero(_np(mask)))
+    return array('i', compress(range(len(mask)), mask))
+
+def array_all_pairs(a):
+    # pairwise AND of the (a[0], a[1]), (a[2], a[3]), ... elements
+    if numpy: return _from_np('B', _np(a).reshape(-1, 2).all(axis=1))
+    return array('B', [(v0 and v1) for v0, v1 in zip(a[0::2], a[1::2])])
+
+def array_all_ranges(a, starts, totals):
+    # AND of the a[start:start+total] slices (ranges must be non-empty)
+    if numpy:
+        if not starts: return array('B')
+        return _from_np('B', numpy.logical_and.reduceat(_np(a) != 0, _np(starts)))
+    return array('B', [all(a[s:s+t]) for s, t in zip(starts, totals)])
+
+def array_bytes(a, byteorder):
+    if sys.byteorder != byteorder:
+        a = a[:]
+        a.byteswap()
+    return a.tobytes()
+
+def array_from_bytes(typecode, b, byteorder):
+    a = array(typecode)
+    a.frombytes(b)
+    if sys.byteorder != byteorder: a.byteswap()
+    return a
+
+def interleave_records(columns, count):
+    # columns are bytes-like objects with count fixed-size fields each;
+    # the result is count records with the fields laid out consecutively
+    widths = [(len(column) // count if count else 0) for column in columns]
+    record_size = sum(widths)
+    buf = bytearray(record_size * count)
+    offset = 0
+    for column, width in zip(columns, widths):
+        column = memoryview(column).cast('B')
+        for k in range(width):
+            buf[offset+k::record_size] = column[k::width]
+        offset += width
+    return buf
+
+def sync_edit_mesh(obj):
+    # Mesh datablock is not updated from the edit bmesh automatically
+    if hasattr(obj, "update_from_editmode"):
+        obj.update_from_editmode()
+    else:
+        with ToggleObjectMode('OBJECT'):
+            pass
+
+class MeshSnapshot:
+    # Same subset that remains after removing all unselected vertices:
+    # selected vertices and the edges/faces consisting only of them.
+    def __init__(self, mesh):
+        vert_select = bulk_get(mesh.vertices, "select", 'i')
+        edge_verts = bulk_get(mesh.edges, "vertices", 'i', 2)
+        loop_starts = bulk_get(mesh.polygons, "loop_start", 'i')
+        loop_totals = bulk_get(mesh.polygons, "loop_total", 'i')
+        loop_verts = bulk_get(mesh.loops, "vertex_index", 'i')
+        loop_edges = bulk_get(mesh.loops, "edge_index", 'i')
+        
+        self.vert_mask = array_cast(vert_select, 'B')
+        self.edge_mask = array_all_pairs(array_take(self.vert_mask, edge_verts))
+        self.face_mask = array_all_ranges(array_take(self.vert_mask, loop_verts), loop_starts, loop_totals)
+        
+        self.vert_remap = array_remap(self.vert_mask)
+        self.edge_remap = array_remap(self.edge_mask)
+        self.face_remap = array_remap(self.face_mask)
+        
+        self.co = array_compress(bulk_get(mesh.vertices, "co", 'f', 3), self.vert_mask, 3)
+        
+        self.edge_verts = array_take(self.vert_remap, array_compress(edge_verts, self.edge_mask, 2))
+        self.edge_seams = array_compress(bulk_get(mesh.edges, "use_seam", 'i'), self.edge_mask)
+        self.edge_smooth = array_not(array_compress(bulk_get(mesh.edges, "use_edge_sharp", 'i'), self.edge_mask))
+        
+        # Mesh loops are stored face after face, so the face mask
+        # can be expanded to a loop mask via the loop totals
+        self.loop_mask = array_repeat(self.face_mask, loop_totals)
+        
+        self.loop_totals = array_compress(loop_totals, self.face_mask)
+        self.loop_verts = array_take(self.vert_remap, array_compress(loop_verts, self.loop_mask))
+        self.loop_edges = array_take(self.edge_remap, array_compress(loop_edges, self.loop_mask))
+        self.face_materials = array_compress(bulk_get(mesh.polygons, "material_index", 'i'), self.face_mask)
+        self.face_smooth = array_compress(bulk_get(mesh.polygons, "use_smooth", 'i'), self.face_mask)
+        
+        # Whole-mesh topology, for cut_masks()
+        self.mesh = mesh
+        self.topology = (edge_verts, loop_totals, loop_verts, loop_edges)
+    
+    def cut_masks(self):
+        # What cut removes (see OperatorCut.cut_mesh()): selected vertices
+        # that have no unselected edges/faces, selected edges that have
+        # no unselected faces, and selected faces
+        edge_verts, loop_totals, loop_verts, loop_edges = self.topology
+        vert_select = self.vert_mask
+        edge_select = array_cast(bulk_get(self.mesh.edges, "select", 'i'), 'B')
+        face_select = array_cast(bulk_get(self.mesh.polygons, "select", 'i'), 'B')
+        
+        edge_keep = array_not(edge_select)
+        loop_keep = array_repeat(array_not(face_select), loop_totals)
+        
+        kept_verts = array_compress(loop_verts, loop_keep)
+        kept_verts.extend(array_compress(edge_verts, edge_keep, 2))
+        kept_edges = array_compress(loop_edges, loop_keep)
+        
+        vert_mask = array_and_not(vert_select, array_scatter(len(vert_select), kept_verts))
+        edge_mask = array_and_not(edge_select, array_scatter(len(edge_select), kept_edges))
+        return vert_mask, edge_mask, face_select
+
+def deinterleave_records(buf, widths, count):
+    # inverse of interleave_records(): returns one bytearray per field
+    record_size = sum(widths)
+    buf = memoryview(buf).cast('B')
+    columns = []
+    offset = 0
+    for width in widths:
+        column = bytearray(width * count)
+        for k in range(width):
+            column[k::width] = buf[offset+k:offset+k+record_size*count:record_size]
+        columns.append(column)
+        offset += width
+    return columns
+
+def _layer_data(layers, name):
+    layer = layers.get(name)
+    return (layer.data if layer else None)
+
+def _shape_data(mesh, name):
+    return (_layer_data(mesh.shape_keys.key_blocks, name) if mesh.shape_keys else None)
+
+# Custom-data layers which the mesh datablock exposes as collections
+# supporting foreach_get: "seq_type.kind" -> (mesh, layer name -> collection,
+# fields in the order of the serializer's record). Each field is
+# (attribute, foreach_get typecode, components, record typecode).
+bulk_layers = {
+    "verts.float":((lambda mesh, name: _layer_data(mesh.vertex_layers_float, name)),
+                   [("value", 'f', 1, 'f')]),
+    "verts.int":((lambda mesh, name: _layer_data(mesh.vertex_layers_int, name)),
+                 [("value", 'i', 1, 'i')]),
+    "verts.bevel_weight":((lambda mesh, name: mesh.vertices),
+                          [("bevel_weight", 'f', 1, 'f')]),
+    "verts.shape":(_shape_data,
+                   [("co", 'f', 3, 'd')]),
+    "verts.skin":((lambda mesh, name: _layer_data(mesh.skin_vertices, name)),
+                  [("radius", 'f', 2, 'f'), ("use_loose", 'i', 1, 'B'), ("use_root", 'i', 1, 'B')]),
+    "verts.paint_mask":((lambda mesh, name: _layer_data(mesh.vertex_paint_masks, name)),
+                        [("value", 'f', 1, 'f')]),
+    "edges.bevel_weight":((lambda mesh, name: mesh.edges),
+                          [("bevel_weight", 'f', 1, 'f')]),
+    "edges.crease":((lambda mesh, name: mesh.edges),
+                    [("crease", 'f', 1, 'f')]),
+    "loops.color":((lambda mesh, name: _layer_data(mesh.vertex_colors, name)),
+                   [("color", 'f', 3, 'f')]),
+    "loops.uv":((lambda mesh, name: _layer_data(mesh.uv_layers, name)),
+                [("pin_uv", 'i', 1, 'B'), ("uv", 'f', 2, 'f')]),
+    "faces.float":((lambda mesh, name: _layer_data(mesh.polygon_layers_float, name)),
+                   [("value", 'f', 1, 'f')]),
+    "faces.int":((lambda mesh, name: _layer_data(mesh.polygon_layers_int, name)),
+                 [("value", 'i', 1, 'i')]),
+}
+
+def bulk_layer_records(mesh, key, layer_name, mask):
+    # Per-element (big-endian) records of the masked elements of a layer,
+    # or None if the layer can't be read in bulk in this version of Blender
+    bulk_info = bulk_layers.get(key)
+    if not bulk_info: return None
+    
+    get_data, fields = bulk_info
+    
+    try:
+        data = get_data(mesh, layer_name)
+        if (data is None) or (len(data) != len(mask)): return None
+        
+        count = 0
+        columns = []
+        for attr, typecode, size, record_typecode in fields:
+            # e.g. vertex colors have alpha since some version
+            actual_size = (len(getattr(data[0], attr)) if data and (size > 1) else size)
+            if actual_size < size: return None
+            
+            column = array_compress(bulk_get(data, attr, typecode, actual_size), mask, actual_size)
+            count = len(column) // actual_size
+            if actual_size != size:
+                column = array_trim(column, actual_size, size)
+            
+            columns.append(array_bytes(array_cast(column, record_typecode), 'big'))
+    except (AttributeError, TypeError, KeyError):
+        return None
+    
+    return interleave_records(columns, count)
+
+class MeshGeometry:
+    # Flat arrays decoded from the verts/edges/faces/select_history chunks
+    def __init__(self, stream, version=1):
+        if version == 1:
+            self.read_v1(stream)
+        else:
+            self.read_v2(stream)
+    
+    def read_v1(self, stream):
+        read = stream.read
+        unpack_from = struct.unpack_from
+        
+        with ChunkReader(stream, "verts") as chunk:
+            self.co = array_from_bytes('d', read(chunk.size), 'big')
+        
+        with ChunkReader(stream, "edges") as chunk:
+            n_edges = chunk.size // 10
+            edge_verts, edge_seams, edge_smooth = deinterleave_records(read(chunk.size), (8, 1, 1), n_edges)
+            self.edge_verts = array_from_bytes('I', edge_verts, 'big')
+            self.edge_seams = array('B', edge_seams)
+            self.edge_smooth = array('B', edge_smooth)
+        
+        # Face records have variable size, so they have to be
+        # scanned one by one (but each loop is not unpacked)
+        with ChunkReader(stream, "faces") as chunk:
+            buf = memoryview(read(chunk.size))
+            loop_totals = array('H')
+            loops = []
+            tails = []
+            pos = 0
+            while pos < len(buf):
+                loop_total = unpack_from('!H', buf, pos)[0]
+                loop_totals.append(loop_total)
+                pos += 2
+                loops.append(buf[pos:pos+loop_total*8])
+                pos += loop_total*8
+                tails.append(buf[pos:pos+3])
+                pos += 3
+            loop_verts, loop_edges = deinterleave_records(b"".join(loops), (4, 4), sum(loop_totals))
+            face_materials, face_smooth = deinterleave_records(b"".join(tails), (2, 1), len(loop_totals))
+            self.loop_totals = loop_totals
+            self.loop_verts = array_from_bytes('I', loop_verts, 'big')
+            self.loop_edges = array_from_bytes('I', loop_edges, 'big')
+            self.face_materials = array_from_bytes('H', face_materials, 'big')
+            self.face_smooth = array('B', face_smooth)
+        
+        with ChunkReader(stream, "select_history") as chunk:
+            elem_types, elem_ids = deinterleave_records(read(chunk.size), (1, 4), chunk.size // 5)
+            self.select_history = list(zip(elem_types.decode('ascii'),
+                                            array_from_bytes('I', elem_ids, 'big')))
+    
+    def read_v2(self, stream):
+        with ChunkReader(stream, "verts"):
+            self.co = read_column(stream, "co")
+        
+        with ChunkReader(stream, "edges"):
+            self.edge_verts = read_column(stream, "verts")
+            self.edge_seams = read_column(stream, "seam")
+            self.edge_smooth = read_column(stream, "smooth")
+        
+        with ChunkReader(stream, "faces"):
+            self.loop_totals = read_column(stream, "loop_total")
+            self.loop_verts = read_column(stream, "loop_verts")
+            self.loop_edges = read_column(stream, "loop_edges")
+            self.face_materials = read_column(stream, "material_index")
+            self.face_smooth = read_column(stream, "smooth")
+        
+        with ChunkReader(stream, "select_history"):
+            elem_types = read_column(stream, "types")
+            elem_ids = read_column(stream, "indices")
+            self.select_history = list(zip(elem_types.tobytes().decode('ascii'), elem_ids))
+    
+    @property
+    def loop_starts(self):
+        loop_starts = array('i', [0]) * len(self.loop_totals)
+        loop_start = 0
+        for i, loop_total in enumerate(self.loop_totals):
+            loop_starts[i] = loop_start
+            loop_start += loop_total
+        return loop_starts
+    
+    def elem_verts(self, elem_type, i):
+        if elem_type == 'V':
+            return (i,)
+        elif elem_type == 'E':
+            return tuple(self.edge_verts[i*2:i*2+2])
+        elif elem_type == 'F':
+            loop_start = sum(self.loop_totals[:i])
+            return tuple(self.loop_verts[loop_start:loop_start+self.loop_totals[i]])
+        return ()
+
+def transform_points(co, matrix):
+    # matrix * point for each point of the flat xyz array
+    # (as for 3D vectors in mathutils: w = 1, no perspective division)
+    rows = [tuple(row) for row in matrix][:3]
+    if numpy:
+        m = numpy.array(rows, 'd')
+        return _from_np('d', numpy.dot(_np(co).reshape(-1, 3), m[:, :3].T) + m[:, 3])
+    xs, ys, zs = co[0::3], co[1::3], co[2::3]
+    result = array('d', [0.0]) * len(co)
+    for axis, (a, b, c, d) in enumerate(rows):
+        result[axis::3] = array('d', [a*x + b*y + c*z + d for x, y, z in zip(xs, ys, zs)])
+    return result
+
+def point_stats(co, active_indices):
+    # (min, max, sum) of the points and (sum, count) of the active ones;
+    # co must be non-empty
+    count = len(co) // 3
+    active_indices = sorted(i for i in set(active_indices) if 0 <= i < count)
+    if numpy:
+        p = _np(co).reshape(-1, 3)
+        active = p[numpy.array(active_indices, 'i')]
+        return (tuple(p.min(axis=0)), tuple(p.max(axis=0)), tuple(p.sum(axis=0)),
+                tuple(active.sum(axis=0)), len(active_indices))
+    axes = [co[axis::3] for axis in range(3)]
+    return (tuple(min(a) for a in axes), tuple(max(a) for a in axes), tuple(sum(a) for a in axes),
+            tuple(sum(a[i] for i in active_indices) for a in axes), len(active_indices))
+
+def edge_chains(vert_count, edge_verts, loop_totals, loop_verts, loop_edges):
+    # Splits mesh into polylines: faces, then chains of edges between
+    # vertices whose degree isn't 2, then the remaining (cyclic) chains.
+    # Returns vertex indices of all points, and (start, count, cyclic)
+    # of each polyline's points.
+    edge_count = len(edge_verts) // 2
+    
+    # Decoded loop columns are unsigned; points are signed
+    loop_verts = array_cast(loop_verts, 'i')
+    
+    # Edges of i-th vertex are adjacency[offsets[i]:offsets[i+1]]
+    # (in the order of edge indices)
+    if numpy:
+        ev = _np(edge_verts)
+        degree = _from_np('i', numpy.bincount(ev, minlength=vert_count))
+        adjacency = _from_np('i', numpy.argsort(ev, kind='mergesort') // 2)
+    else:
+        degree = array('i', [0]) * vert_count
+        for vi in edge_verts:
+            degree[vi] += 1
+        adjacency = array('i', [0]) * len(edge_verts)
+    
+    offsets = array('i', [0]) * (vert_count + 1)
+    for vi in range(vert_count):
+        offsets[vi+1] = offsets[vi] + degree[vi]
+    
+    if not numpy:
+        fill = offsets[:-1]
+        for i, vi in enumerate(edge_verts):
+            adjacency[fill[vi]] = i // 2
+            fill[vi] += 1
+    
+    def other_vert(ei, vi):
+        v0, v1 = edge_verts[ei*2], edge_verts[ei*2+1]
+        return (v1 if v0 == vi else (v0 if v1 == vi else -1))
+    
+    def other_edge(vi, ei):
+        if degree[vi] != 2: return -1
+        e0, e1 = adjacency[offsets[vi]], adjacency[offsets[vi]+1]
+        return (e1 if e0 == ei else (e0 if e1 == ei else -1))
+    
+    used_edges = bytearray(edge_count)
+    points = array('i')
+    cyclic_splines = []
+    splines = []
+    
+    loop_start = 0
+    for loop_total in loop_totals:
+        cyclic_splines.append((len(points), loop_total, True))
+        points.extend(loop_verts[loop_start:loop_start+loop_total])
+        loop_start += loop_total
+    for ei in loop_edges:
+        used_edges[ei] = 1
+    
+    # link non-cyclic edges
+    for vi0 in range(vert_count):
+        if degree[vi0] == 2: continue
+        
+        for ei in adjacency[offsets[vi0]:offsets[vi0+1]]:
+            if used_edges[ei]: continue
+            
+            start = len(points)
+            vi = vi0
+            while True:
+                points.append(vi)
+                if ei == -1: break
+                used_edges[ei] = 1
+                vi = other_vert(ei, vi)
+                ei = other_edge(vi, ei)
+            splines.append((start, len(points) - start, False))
+    
+    # link cyclic edges
+    for vi in range(vert_count):
+        if degree[vi] != 2: continue
+        ei = adjacency[offsets[vi]]
+        if used_edges[ei] or used_edges[adjacency[offsets[vi]+1]]: continue
+        
+        start = len(points)
+        while True:
+            points.append(vi)
+            if (ei == -1) or used_edges[ei]: break
+            used_edges[ei] = 1
+            vi = other_vert(ei, vi)
+            ei = other_edge(vi, ei)
+        cyclic_splines.append((start, len(points) - start, True))
+    
+    return points, cyclic_splines + splines
+
 def is_view3d(context):
     return ((context.area.type == 'VIEW_3D') and (context.region.type == 'WINDOW'))
 
@@ -332,26 +1103,80 @@ def get_view_rotation(context):
 def make_clipboard_path():
     clipboards_path = get_clipboards_dir()
     
-    lib_paths = set(os.path.normcase(bpy.path.abspath(lib.filepath))
-                    for lib in bpy.data.libraries)
+    lib_paths = library_paths()
     
     startkey = str(int(time.clock())).replace(".", "_") + "_"
     i = 0
     while True:
         name = "clipboard.%s.blend" % (startkey + str(i))
         path = os.path.normcase(os.path.join(clipboards_path, name))
-        if (path not in lib_paths) and (not os.path.exists(path)):
+        if (path not in lib_paths) and (not os.path.exists(path)) and \
+                (not os.path.exists(staging_clipboard_path(path))) and \
+                (not clipboard_store.has_name(name)):
             return path
         i += 1
 
-def remove_clipboard_files():
-    clipboards_path = get_clipboards_dir()
-    
-    filemask = os.path.join(clipboards_path, "clipboard.*.blend")
-    for path in glob.glob(filemask):
-        os.remove(path)
+class LibraryPathIndex:
+    # Normalized (absolute, normcase'd) paths of bpy.data.libraries, and
+    # a cache of is_clipboard_path() results. Rebuilt after a file is
+    # loaded, or when library paths or the .blend path (which relative
+    # library paths depend on) change.
+    def __init__(self):
+        self.invalidate()
+    
+    def invalidate(self):
+        self.signature = None
+        self.paths = frozenset()
+        self.clipboard_paths = {}
+    
+    def update(self):
+        lib_paths = tuple(lib.filepath for lib in bpy.data.libraries)
+        signature = (lib_paths, bpy.data.filepath)
+        if signature == self.signature: return
+        self.signature = signature
+        self.paths = frozenset(os.path.normcase(bpy.path.abspath(lib_path))
+                               for lib_path in lib_paths)
+        self.clipboard_paths = {}
+
+library_path_index = LibraryPathIndex()
+
+# Identifies the file objects were copied from, so that materials
+# appended from its clipboards can be reused (see process_object()).
+# An unsaved file is told apart from other (unsaved) files by the
+# session and the time it was loaded.
+def make_unsaved_file_id():
+    return "<unsaved:{}:{}>".format(os.getpid(), time.time())
+
+unsaved_file_id = make_unsaved_file_id()
+
+def clipboard_source_id():
+    if not bpy.data.filepath: return unsaved_file_id
+    return os.path.normcase(bpy.path.abspath(bpy.data.filepath))
+
+# (source id, source material name) -> name of the pasted material
+pasted_materials = {}
+
+@addon.load_post
+def load_post():
+    global unsaved_file_id
+    unsaved_file_id = make_unsaved_file_id()
+    pasted_materials.clear()
+    library_path_index.invalidate()
+
+def library_paths():
+    library_path_index.update()
+    return library_path_index.paths
 
 def is_clipboard_path(path):
+    library_path_index.update()
+    cache = library_path_index.clipboard_paths
+    result = cache.get(path)
+    if result is None:
+        result = _is_clipboard_path(path)
+        cache[path] = result
+    return result
+
+def _is_clipboard_path(path):
     clipboards_path = get_clipboards_dir()
     
     path = os.path.normcase(bpy.path.abspath(path))
@@ -365,11 +1190,473 @@ def is_clipboard_path(path):
     
     return False
 
-def save_clipboard_file(filepath):
-    remove_clipboard_files()
+# bpy can only be used from the main thread, so the data is written
+# to a staging file first; storing it (and compressing, if
+# requested) happens in the background. Paste waits for the job of
+# the clipboard it reads (the job token is stored in the JSON).
+clipboard_jobs = {}
+clipboard_executor = None
+
+def staging_clipboard_path(filepath):
+    # doesn't match the clipboard.*.blend mask
+    dir_path, name = os.path.split(filepath)
+    return os.path.join(dir_path, "~" + name)
+
+def save_clipboard_file(filepath, objs=None, compress=False, limits=None):
+    global clipboard_executor
+    
     dir_path = os.path.dirname(filepath)
     if not os.path.exists(dir_path): os.makedirs(dir_path)
-    bpy.ops.wm.save_as_mainfile(filepath=filepath, check_existing=False, copy=True)
+    
+    staging_path = staging_clipboard_path(filepath)
+    
+    # Partial writing is available since Blender 2.72
+    # (no fake users: appending keeps the flag on the pasted data,
+    # which then would never be freed)
+    if (objs is None) or not hasattr(bpy.data.libraries, "write"):
+        bpy.ops.wm.save_as_mainfile(filepath=staging_path, check_existing=False, copy=True)
+    else:
+        bpy.data.libraries.write(staging_path, object_dependencies(objs),
+            relative_remap=True, fake_user=False)
+    
+    if clipboard_executor is None:
+        clipboard_executor = ThreadPoolExecutor(max_workers=1)
+    
+    # Jobs of clipboards that were never pasted are forgotten
+    # once they are done
+    for name, future in list(clipboard_jobs.items()):
+        if future.done(): del clipboard_jobs[name]
+    
+    job = os.path.basename(filepath)
+    clipboard_jobs[job] = clipboard_executor.submit(finish_clipboard_file,
+        staging_path, job, compress, library_paths(), limits or {})
+    return job
+
+def finish_clipboard_file(staging_path, name, compress, keep_paths, limits):
+    if compress:
+        # Blender reads gzipped .blend files transparently
+        # (zero mtime and no file name keep the hash reproducible)
+        gz_path = staging_path + ".gz"
+        with open(staging_path, "rb") as src, open(gz_path, "wb") as dst:
+            with gzip.GzipFile("", "wb", 1, dst, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, 1024*1024)
+        os.remove(staging_path)
+        staging_path = gz_path
+    
+    clipboard_store.add(staging_path, ".blend", name=name, keep_paths=keep_paths, **limits)
+
+def wait_clipboard_job(job):
+    future = clipboard_jobs.pop(job, None)
+    if future: future.result()
+
+@addon.on_unregister
+def shutdown_clipboard_jobs():
+    global clipboard_executor
+    if clipboard_executor is None: return
+    clipboard_executor.shutdown(wait=True)
+    clipboard_executor = None
+    clipboard_jobs.clear()
+
+def object_dependencies(objs):
+    # Objects, their parents and directly used data; the rest
+    # (images, node groups, etc.) is added by libraries.write()
+    datablocks = set()
+    objs = list(objs)
+    while objs:
+        obj = objs.pop()
+        if obj in datablocks: continue
+        datablocks.add(obj)
+        if obj.parent: objs.append(obj.parent)
+        if obj.data: datablocks.add(obj.data)
+        for slot in obj.material_slots:
+            if slot.material: datablocks.add(slot.material)
+    return datablocks
+
+def file_hash(path):
+    hash = hashlib.sha1()
+    with open(path, "rb") as f:
+        for b in iter((lambda: f.read(1024*1024)), b""):
+            hash.update(b)
+    return hash.hexdigest()
+
+class InterProcessLock:
+    # Excludes the threads of this process as well as other processes
+    # (Blender instances share the clipboards directory): the lock file
+    # exists while the lock is held. A lock file older than the timeout
+    # is assumed to be left by a crashed process.
+    def __init__(self, get_path, timeout=10.0):
+        self.get_path = get_path
+        self.timeout = timeout
+        self.lock = threading.Lock()
+    
+    def __enter__(self):
+        self.lock.acquire()
+        try:
+            path = self.get_path()
+            dir_path = os.path.dirname(path)
+            if not os.path.exists(dir_path): os.makedirs(dir_path)
+            while True:
+                try:
+                    os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                    break
+                except FileExistsError:
+                    pass
+                try:
+                    if time.time() - os.path.getmtime(path) > self.timeout:
+                        os.remove(path)
+                        continue
+                except OSError:
+                    continue # removed in the meantime
+                time.sleep(0.01)
+        except:
+            self.lock.release()
+            raise
+        self.path = path
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        self.lock.release()
+
+class ClipboardStore:
+    # Clipboard files are named by the hash of their content (so identical
+    # copies are stored only once) and listed in the index file along with
+    # their size and last use time. When the total size exceeds the limit,
+    # least recently used files are removed, except the most recent ones
+    # and the ones currently loaded as libraries. Clipboard .blend files
+    # are referred to by names (see make_clipboard_path()), which the
+    # index maps to the actual files. Only the most recent names of each
+    # file are kept (identical copies add new names to the same file).
+    index_name = "clipboards.json"
+    lock_name = "clipboards.lock"
+    max_names = 8 # per file
+    
+    def __init__(self):
+        # Used from the clipboard jobs and other Blender instances too
+        self.lock = InterProcessLock(lambda: os.path.join(get_clipboards_dir(), self.lock_name))
+    
+    def file_path(self, key):
+        # key is hash + extension
+        return os.path.normcase(os.path.join(get_clipboards_dir(), "clipboard." + key))
+    
+    def index_path(self):
+        return os.path.join(get_clipboards_dir(), self.index_name)
+    
+    def load_index(self):
+        try:
+            with open(self.index_path(), "r") as f:
+                index = json.load(f)
+            files = index["files"]
+            names = index["names"]
+        except (IOError, ValueError, KeyError, TypeError):
+            return {"files":{}, "names":{}}
+        
+        # The files may have been removed (e.g. by temp directory cleanup)
+        for key in [key for key in files if not os.path.isfile(self.file_path(key))]:
+            del files[key]
+        
+        return index
+    
+    def save_index(self, index):
+        path = self.index_path()
+        fd, tmp_path = tempfile.mkstemp(".tmp", "~" + self.index_name + ".", os.path.dirname(path))
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f, separators=(',',':'))
+        os.replace(tmp_path, path)
+    
+    def add(self, src_path, ext, hash=None, name=None, max_size=0, keep_count=1, keep_paths=()):
+        # Moves src_path into the store, returns the path of the stored file
+        if hash is None: hash = file_hash(src_path)
+        key = hash + ext
+        path = self.file_path(key)
+        
+        with self.lock:
+            index = self.load_index()
+            
+            if os.path.isfile(path):
+                os.remove(src_path) # same content is already stored
+            else:
+                os.replace(src_path, path)
+            
+            file_names = index["files"].get(key, {}).get("names", [])
+            if name: self.add_name(index, file_names, name, key)
+            index["files"][key] = {"size":os.path.getsize(path), "time":time.time(), "names":file_names}
+            
+            self.evict(index, max_size, keep_count, set(keep_paths) | {path})
+            self.save_index(index)
+        
+        return path
+    
+    def add_name(self, index, file_names, name, key):
+        # file_names: names of the file, the most recent last
+        names = index["names"]
+        if name in file_names: file_names.remove(name)
+        file_names.append(name)
+        names[name] = key
+        while len(file_names) > self.max_names:
+            old_name = file_names.pop(0)
+            if names.get(old_name) == key: del names[old_name]
+    
+    def evict(self, index, max_size, keep_count, keep_paths):
+        files = index["files"]
+        keys = sorted(files, key=(lambda key: files[key]["time"]), reverse=True)
+        
+        total_size = 0
+        for i, key in enumerate(keys):
+            total_size += files[key]["size"]
+            if (i < keep_count) or (total_size <= max_size): continue
+            
+            path = self.file_path(key)
+            if path in keep_paths: continue
+            
+            try:
+                os.remove(path)
+            except OSError:
+                continue # e.g. opened by another program
+            
+            total_size -= files.pop(key)["size"]
+        
+        names = index["names"]
+        for name in [name for name, key in names.items() if key not in files]:
+            del names[name]
+    
+    def touch(self, key):
+        with self.lock:
+            index = self.load_index()
+            if key not in index["files"]: return
+            index["files"][key]["time"] = time.time()
+            self.save_index(index)
+    
+    def has_name(self, name):
+        with self.lock:
+            return name in self.load_index()["names"]
+    
+    def resolve(self, path):
+        # Clipboard name -> path of the stored file (other paths are returned as is)
+        with self.lock:
+            key = self.load_index()["names"].get(os.path.basename(path))
+        if not key: return path
+        self.touch(key)
+        return self.file_path(key)
+
+clipboard_store = ClipboardStore()
+
+def store_limits():
+    opts = addon.preferences
+    return {"max_size":opts.store_size*1024*1024, "keep_count":opts.store_keep}
+
+# Big element data is not put into wm.clipboard (multi-megabyte strings
+# going through the OS clipboard and JSON are slow); instead it's kept
+# in the clipboard store, and the clipboard JSON only refers to it.
+def blob_clipboard_path(hash):
+    return clipboard_store.file_path(hash + ".data")
+
+def save_clipboard_blob(b, codec):
+    blob = BlobWriter(codec)
+    blob.write(codecs[codec].compress(b))
+    return blob.finish()
+
+class BlobWriter:
+    # Writes already compressed data to a temporary file, hashing it
+    # on the fly; the file gets its final name in finish()
+    def __init__(self, codec):
+        self.codec = codec
+        self.hash = hashlib.sha1()
+        self.size = 0
+        
+        # (the directory is shared by all running Blender instances)
+        dir_path = get_clipboards_dir()
+        if not os.path.exists(dir_path): os.makedirs(dir_path)
+        fd, self.tmp_path = tempfile.mkstemp(".tmp", "~clipboard.", dir_path)
+        self.file = os.fdopen(fd, "wb")
+    
+    def write(self, b):
+        self.hash.update(b)
+        self.size += len(b)
+        self.file.write(b)
+    
+    def finish(self):
+        self.file.close()
+        
+        hash = self.hash.hexdigest()
+        clipboard_store.add(self.tmp_path, ".data", hash, keep_paths=library_paths(), **store_limits())
+        
+        return {"hash":hash, "size":self.size, "codec":self.codec}
+
+def load_clipboard_blob(ref):
+    hash = ref["hash"]
+    assert isinstance(hash, str) and hash.isalnum()
+    
+    # Uncompressed data is used directly from the mapped file
+    b = map_file(blob_clipboard_path(hash))
+    
+    if (len(b) != ref["size"]) or (hashlib.sha1(b).hexdigest() != hash):
+        raise ValueError("Clipboard file is corrupted")
+    
+    clipboard_store.touch(hash + ".data")
+    
+    codec = ref["codec"]
+    return (b if codec == "none" else codecs[codec].decompress(b))
+
+class ClipboardEntry:
+    def __init__(self, label, json_text, data=None):
+        self.label = label
+        self.json_text = json_text # without the inline element data
+        self.data = data # uncompressed element data, if kept in memory
+
+class ClipboardHistory:
+    # Recent clipboards, the most recent first. Element data stays in
+    # memory until the total size exceeds the budget; then the oldest
+    # data is moved to the clipboard store (unless it's already there),
+    # and the entry refers to it.
+    def __init__(self):
+        self.entries = deque()
+    
+    def __len__(self):
+        return len(self.entries)
+    
+    def __iter__(self):
+        return iter(self.entries)
+    
+    def __getitem__(self, index):
+        return self.entries[index]
+    
+    def push(self, label, json_data, data=None, max_count=10, max_memory=0, codec="auto"):
+        json_data = dict(json_data)
+        json_data.pop("data", None)
+        json_data.pop("codec", None)
+        
+        self.entries.appendleft(ClipboardEntry(label, json.dumps(json_data), data))
+        while len(self.entries) > max_count:
+            self.entries.pop()
+        
+        self.spill(max_memory, codec)
+    
+    def spill(self, max_memory, codec="auto"):
+        size = sum(len(entry.data) for entry in self.entries if entry.data is not None)
+        for entry in reversed(self.entries):
+            if size <= max_memory: break
+            if entry.data is None: continue
+            size -= len(entry.data)
+            json_data = json.loads(entry.json_text)
+            if "data_ref" not in json_data:
+                blob_codec = resolve_codec(codec, len(entry.data))
+                json_data["data_ref"] = save_clipboard_blob(entry.data, blob_codec)
+                entry.json_text = json.dumps(json_data)
+            entry.data = None
+
+clipboard_history = ClipboardHistory()
+
+# In v2 clipboards, the per-object data is stored in a binary manifest:
+# a string table (object names first, then other names), library ids,
+# world matrices (float64, 16 per object, row by row), and string
+# indices of the parents and parent bones (-1 for none).
+def encode_object_manifest(objects, matrices, parents, codec):
+    names = list(objects.keys())
+    strings = {name:i for i, name in enumerate(names)}
+    
+    def string_index(s):
+        if not s: return -1
+        i = strings.get(s)
+        if i is None:
+            i = len(names)
+            strings[s] = i
+            names.append(s)
+        return i
+    
+    count = len(objects)
+    library_ids = array('I', (int(objects[name]) for name in names))
+    matrix_values = array('d')
+    parent_indices = array('i', [-1]) * count
+    bone_indices = array('i', [-1]) * count
+    for i, name in enumerate(names[:count]):
+        for row in matrices[name]:
+            matrix_values.extend(row)
+        parent_info = parents.get(name)
+        if parent_info:
+            parent_indices[i] = string_index(parent_info[0])
+            bone_indices[i] = string_index(parent_info[1])
+    
+    stream = io.BytesIO()
+    with ChunkWriter(stream, "strings"):
+        stream.write("\0".join(names).encode('utf-8'))
+    write_column(stream, "libraries", library_ids)
+    write_column(stream, "matrices", matrix_values, 16)
+    write_column(stream, "parents", parent_indices)
+    write_column(stream, "parent_bones", bone_indices)
+    
+    b = stream.getvalue()
+    codec = resolve_codec(codec, len(b))
+    return {"codec":codec, "data":compress_b64(b, codec)}
+
+def decode_object_manifest(manifest):
+    # Returns objects (name -> library id), matrices, parents
+    # (in the same form as in v1 clipboards, except matrices)
+    stream = BufferStream(decompress_b64(manifest["data"], manifest["codec"]))
+    with ChunkReader(stream, "strings") as chunk:
+        names = str(stream.read(chunk.size), 'utf-8').split("\0")
+    library_ids = read_column(stream, "libraries")
+    matrix_values = read_column(stream, "matrices")
+    parent_indices = read_column(stream, "parents")
+    bone_indices = read_column(stream, "parent_bones")
+    
+    count = len(library_ids)
+    assert len(parent_indices) == len(bone_indices) == count
+    assert len(matrix_values) == count * 16
+    
+    objects = dict(zip(names, map(str, library_ids)))
+    
+    parents = {}
+    for i, parent_index in enumerate(parent_indices):
+        if parent_index < 0: continue
+        bone_index = bone_indices[i]
+        parents[names[i]] = (names[parent_index], (names[bone_index] if bone_index >= 0 else ""))
+    
+    return objects, MatrixMap(names[:count], matrix_values), parents
+
+class MatrixMap:
+    # name -> Matrix, created on access from the flat array
+    def __init__(self, names, values):
+        self.indices = {name:i for i, name in enumerate(names)}
+        self.values = values
+    
+    def __contains__(self, name):
+        return name in self.indices
+    
+    def __getitem__(self, name):
+        i = self.indices[name] * 16
+        v = self.values
+        return Matrix((v[i:i+4], v[i+4:i+8], v[i+8:i+12], v[i+12:i+16]))
+    
+    def get(self, name, default=None):
+        return (self[name] if name in self.indices else default)
+
+class LibraryListings:
+    # Object names in library files, remembered from the previous loads.
+    # A listing is valid while the file's (mtime, size) stays the same,
+    # so it's known which objects are available without opening the file.
+    def __init__(self):
+        self.listings = {} # path -> ((mtime, size), object names)
+    
+    def stat(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime, st.st_size)
+    
+    def objects(self, path, stat):
+        listing = self.listings.get(path)
+        if listing and (listing[0] == stat): return listing[1]
+        return None
+    
+    def update(self, path, stat, names):
+        self.listings[path] = (stat, frozenset(names))
+
+library_listings = LibraryListings()
 
 def data_clipboard_path():
     #resource_path = bpy.utils.resource_path('LOCAL') # USER SYSTEM
@@ -396,17 +1683,37 @@ class VIEW3D_PT_copy_paste:
             coordsystem = opts.actual_coordsystem(context)
             icon = self.coordsystem_icons[coordsystem]
             layout.prop_menu_enum(opts, "coordinate_system", text="", icon=icon)
+        
+        if clipboard_history:
+            with layout.column(True)(enabled=(context.mode in copy_paste_modes)):
+                for i, entry in enumerate(clipboard_history):
+                    layout.operator("view3d.paste_history", text=entry.label, icon='PASTEDOWN').index = i
+
+# Cut removes the same selection that is copied, so it reuses
+# the copy's snapshot instead of traversing the mesh again
+cut_snapshot = None
+
+def keep_cut_snapshot(snapshot):
+    global cut_snapshot
+    cut_snapshot = snapshot
+
+def take_cut_snapshot():
+    global cut_snapshot
+    snapshot = cut_snapshot
+    cut_snapshot = None
+    return snapshot
 
 @addon.Operator(idname="view3d.copy", label="Copy objects/elements", description="Copy objects/elements")
 class OperatorCopy:
     force_copy = False | -prop()
+    keep_snapshot = False | -prop() # used by cut
     
     @classmethod
     def poll(cls, context):
         if context.mode not in copy_paste_modes: return False
         return context.selected_objects
     
-    def write_object(self, json_data, context):
+    def write_object(self, json_data, context, version):
         wm = context.window_manager
         opts = addon.preferences
         
@@ -445,6 +1752,7 @@ class OperatorCopy:
         objects = {}
         matrices = {}
         parents = {}
+        materials = {}
         active_obj = context.object
         
         for obj in context.selected_objects:
@@ -457,27 +1765,35 @@ class OperatorCopy:
             
             if obj.parent:
                 parents[obj.name] = (obj.parent.name, obj.parent_bone)
-        
-        json_data["objects"] = objects
-        json_data["matrices"] = matrices
-        json_data["parents"] = parents
+            
+            # Materials from the same file as the object
+            lib_materials = materials.setdefault(library_id(obj), set())
+            for slot in obj.material_slots:
+                if slot.material and (slot.material.library == obj.library):
+                    lib_materials.add(slot.material.name)
+        
+        if version > 1:
+            json_data["manifest"] = encode_object_manifest(objects, matrices, parents, opts.codec.lower())
+        else:
+            json_data["objects"] = objects
+            json_data["matrices"] = matrices
+            json_data["parents"] = parents
+        json_data["materials"] = {id:sorted(names) for id, names in materials.items()}
+        json_data["source"] = clipboard_source_id()
         
         json_data["libraries"] = libraries_inv
         
         if self_library and (self_library in libraries):
             if self_is_clipboard:
-                save_clipboard_file(self_library)
-            """
-            if self_is_clipboard:
-                remove_clipboard_files()
-                bpy.ops.wm.save_as_mainfile(filepath=self_library,
-                    check_existing=False, copy=True)
-            else:
-                # make sure the file is up-to-date
-                bpy.ops.wm.save_mainfile(check_existing=False)
-            """
+                if opts.full_file_copy:
+                    objs = None
+                else:
+                    objs = [obj for obj in context.selected_objects if not obj.library]
+                json_data["job"] = save_clipboard_file(self_library, objs, opts.compress_file, store_limits())
+        
+        return objects
     
-    def write_mesh(self, obj, stream):
+    def write_mesh(self, obj, stream, version):
         iofuncs = def_write_funcs(stream)
         # No faster way around. In Python 3.x, we have
         # to declare each local variable manually.
@@ -528,55 +1844,54 @@ class OperatorCopy:
         # A ~bug? Iterating layers.*.items() yields BMLayerItem,
         # and iterating layers.*.values() yields (item_name, BMLayerItem)
         
-        # Seems like just removing all the unselected vertices is
-        # the easiest way -- only the relevant edges, loops, faces
-        # and layer data remain.
-        # After removal, order of elements does not change,
-        # and linked elements don't have to be checked for is_valid
-        # (removed ones simply don't come up in the iteration).
+        # Geometry is read from the mesh datablock in bulk (the selected
+        # subset is the same as if all unselected vertices were removed);
+        # the edit bmesh is only used for select history and layers.
+        # Mesh and edit bmesh have the same order of elements.
+        sync_edit_mesh(obj)
         
-        bm = bmesh.from_edit_mesh(obj.data).copy()
+        snapshot = MeshSnapshot(obj.data)
         
-        i = 0
-        with ChunkWriter(stream, "verts"):
-            for v in bm.verts:
-                if v.select:
-                    write(pack('!ddd', *v.co))
-                    v.index = i
-                    i += 1
-                else:
-                    bm.verts.remove(v)
+        if self.keep_snapshot:
+            keep_cut_snapshot(snapshot)
         
-        i = 0
-        with ChunkWriter(stream, "edges"):
-            for e in bm.edges:
-                for v in e.verts:
-                    write(pack('!I', v.index))
-                write(pack('!?', e.seam))
-                write(pack('!?', e.smooth))
-                e.index = i
-                i += 1
+        bm = bmesh.from_edit_mesh(obj.data)
         
-        i = 0
-        with ChunkWriter(stream, "faces"):
-            for f in bm.faces:
-                write(pack('!H', len(f.loops)))
-                for l in f.loops:
-                    write(pack('!I', l.vert.index))
-                    write(pack('!I', l.edge.index))
-                write(pack('!H', f.material_index))
-                write(pack('!?', f.smooth))
-                f.index = i
-                i += 1
+        remaps = {bmesh.types.BMVert:('V', snapshot.vert_remap, bm.verts),
+                  bmesh.types.BMEdge:('E', snapshot.edge_remap, bm.edges),
+                  bmesh.types.BMFace:('F', snapshot.face_remap, bm.faces)}
         
-        select_types = {bmesh.types.BMVert:b'V',
-                        bmesh.types.BMEdge:b'E',
-                        bmesh.types.BMFace:b'F'}
+        if bm.select_history:
+            for elem_type, remap, seq in remaps.values():
+                seq.index_update()
         
-        with ChunkWriter(stream, "select_history"):
-            for elem in bm.select_history:
-                write(select_types[type(elem)])
-                write(pack('!I', elem.index))
+        snapshot.select_history = []
+        for elem in bm.select_history:
+            elem_type, remap, seq = remaps[type(elem)]
+            i = remap[elem.index]
+            if i < 0: continue # unselected elements were not copied
+            snapshot.select_history.append((elem_type, i))
+        
+        if version == 1:
+            self.write_mesh_geometry_v1(stream, snapshot)
+        else:
+            self.write_mesh_geometry_v2(stream, snapshot)
+        
+        masks = {"verts":snapshot.vert_mask,
+                 "edges":snapshot.edge_mask,
+                 "faces":snapshot.face_mask,
+                 "loops":snapshot.loop_mask}
+        
+        # These don't write anything, no need to iterate elements
+        null_serializers = {serializer_tex, serializer_freestyle}
+        
+        # Layers with a bulk accessor in the mesh datablock are read in
+        # whole arrays; the rest is serialized element-by-element from bmesh
+        def serialize_bulk(key, layer_name, mask):
+            records = bulk_layer_records(obj.data, key, layer_name, mask)
+            if records is None: return False
+            write(records)
+            return True
         
         def serialize_loops():
             with ChunkWriter(stream, "loops"):
@@ -593,7 +1908,9 @@ class OperatorCopy:
                             layer = layers[layer_name]
                             
                             with ChunkWriter(stream, layer_name):
-                                for f in bm.faces:
+                                if serializer in null_serializers: continue
+                                if serialize_bulk("loops." + k, layer_name, masks["loops"]): continue
+                                for f in compress(bm.faces, snapshot.face_mask):
                                     for l in f.loops:
                                         serializer(l[layer])
         
@@ -601,6 +1918,7 @@ class OperatorCopy:
             for seq_type in ("verts", "edges", "faces"):
                 seq = getattr(bm, seq_type)
                 seq_layers = seq.layers
+                mask = masks[seq_type]
                 
                 with ChunkWriter(stream, seq_type):
                     for k in dir(seq_layers):
@@ -616,14 +1934,86 @@ class OperatorCopy:
                                 layer = layers[layer_name]
                                 
                                 with ChunkWriter(stream, layer_name):
-                                    for elem in seq:
+                                    if serializer in null_serializers: continue
+                                    if serializer == serializer_deform and version > 1:
+                                        write_deform_csr(stream, compress(seq, mask), layer, addon.preferences.quantize_weights)
+                                        continue
+                                    if serialize_bulk(seq_type + "." + k, layer_name, mask): continue
+                                    for elem in compress(seq, mask):
                                         serializer(elem[layer])
                         
                         if seq_type == "faces":
                             # bm.loops (BMLoopsSeq) are not iterable %)
                             serialize_loops()
+    
+    def write_mesh_geometry_v1(self, stream, snapshot):
+        # Each chunk is assembled in memory and written at once.
+        # Records are big-endian and interleaved (per-element),
+        # which is done by byte-strided copying of whole columns.
+        write = stream.write
+        
+        with ChunkWriter(stream, "verts"):
+            write(array_bytes(array_cast(snapshot.co, 'd'), 'big'))
+        
+        n_edges = len(snapshot.edge_smooth)
+        with ChunkWriter(stream, "edges"):
+            write(interleave_records([
+                array_bytes(array_cast(snapshot.edge_verts, 'I'), 'big'),
+                array_bytes(array_cast(snapshot.edge_seams, 'B'), 'big'),
+                array_bytes(array_cast(snapshot.edge_smooth, 'B'), 'big'),
+            ], n_edges))
+        
+        n_faces = len(snapshot.loop_totals)
+        n_loops = len(snapshot.loop_verts)
+        headers = array_bytes(array_cast(snapshot.loop_totals, 'H'), 'big')
+        loops = interleave_records([
+            array_bytes(array_cast(snapshot.loop_verts, 'I'), 'big'),
+            array_bytes(array_cast(snapshot.loop_edges, 'I'), 'big'),
+        ], n_loops)
+        tails = interleave_records([
+            array_bytes(array_cast(snapshot.face_materials, 'H'), 'big'),
+            array_bytes(array_cast(snapshot.face_smooth, 'B'), 'big'),
+        ], n_faces)
+        
+        # Face records have variable size, so they can't be
+        # interleaved by striding; but slicing is still cheap
+        headers, loops, tails = memoryview(headers), memoryview(loops), memoryview(tails)
+        parts = []
+        loop_start = 0
+        for i, loop_total in enumerate(snapshot.loop_totals):
+            loop_end = loop_start + loop_total
+            parts.append(headers[i*2:i*2+2])
+            parts.append(loops[loop_start*8:loop_end*8])
+            parts.append(tails[i*3:i*3+3])
+            loop_start = loop_end
+        
+        with ChunkWriter(stream, "faces"):
+            write(b"".join(parts))
         
-        bm.free()
+        with ChunkWriter(stream, "select_history"):
+            for elem_type, i in snapshot.select_history:
+                write(struct.pack('!cI', elem_type.encode('ascii'), i))
+    
+    def write_mesh_geometry_v2(self, stream, snapshot):
+        with ChunkWriter(stream, "verts"):
+            write_column(stream, "co", array_cast(snapshot.co, 'd'), 3)
+        
+        with ChunkWriter(stream, "edges"):
+            write_column(stream, "verts", array_cast(snapshot.edge_verts, 'I'), 2)
+            write_column(stream, "seam", array_cast(snapshot.edge_seams, 'B'))
+            write_column(stream, "smooth", array_cast(snapshot.edge_smooth, 'B'))
+        
+        with ChunkWriter(stream, "faces"):
+            write_column(stream, "loop_total", array_cast(snapshot.loop_totals, 'I'))
+            write_column(stream, "loop_verts", array_cast(snapshot.loop_verts, 'I'))
+            write_column(stream, "loop_edges", array_cast(snapshot.loop_edges, 'I'))
+            write_column(stream, "material_index", array_cast(snapshot.face_materials, 'H'))
+            write_column(stream, "smooth", array_cast(snapshot.face_smooth, 'B'))
+        
+        with ChunkWriter(stream, "select_history"):
+            elem_types = "".join(elem_type for elem_type, i in snapshot.select_history)
+            write_column(stream, "types", array('B', elem_types.encode('ascii')))
+            write_column(stream, "indices", array('I', [i for elem_type, i in snapshot.select_history]))
     
     def write_curve(self, json_data, context):
         obj = context.object
@@ -780,6 +2170,12 @@ class OperatorCopy:
         
         json_data = {"content":"Blender 3D-clipboard"}
         
+        version = (1 if opts.legacy_format else clipboard_version)
+        json_data["version"] = version
+        
+        # Older versions can't read the chunk index
+        streaming = (opts.streaming and (version > 1))
+        
         json_data["cursor"] = tuple(context.space_data.cursor_location)
         
         if is_view3d(context):
@@ -791,13 +2187,18 @@ class OperatorCopy:
             json_data["type"] = obj.type
             json_data["matrix"] = [tuple(v) for v in obj.matrix_world]
             
-            if opts.external:
-                stream = io.BytesIO()
+            # (element data is also kept in the clipboard history)
+            b = None
+            
+            if opts.external and streaming:
+                codec = resolve_codec(opts.codec.lower())
+                blob = BlobWriter(codec)
+                stream = ChunkStream(blob, codecs[codec].compressor())
             else:
-                stream = open(data_clipboard_path(), "wb")
+                stream = io.BytesIO()
             
             if obj.type == 'MESH':
-                self.write_mesh(obj, stream)
+                self.write_mesh(obj, stream, version)
             elif obj.type in ('CURVE', 'SURFACE'):
                 stream.close()
                 return {'CANCELLED'} # for now
@@ -816,28 +2217,51 @@ class OperatorCopy:
                 return {'CANCELLED'} # for now
                 self.write_armature(json_data, context)
             
-            if opts.external:
+            if opts.external and streaming:
+                stream.close()
+                json_data["data_ref"] = blob.finish()
+                json_data["chunk_index"] = True
+            elif opts.external:
                 b = stream.getvalue()
                 stream.close()
-                json_data["data"] = compress_b64(b)
+                if version == 1:
+                    codec = "bz2" # older versions always decompress bz2
+                else:
+                    codec = resolve_codec(opts.codec.lower(), len(b))
+                # Older versions don't know data_ref (and would paste
+                # the local clipboard.data instead)
+                if (version > 1) and (len(b) > opts.external_file_threshold * 1024):
+                    json_data["data_ref"] = save_clipboard_blob(b, codec)
+                else:
+                    if version > 1: json_data["codec"] = codec
+                    json_data["data"] = compress_b64(b, codec)
             else:
+                b = stream.getvalue()
                 stream.close()
+                with open(data_clipboard_path(), "wb") as f:
+                    f.write(b)
         else:
             json_data["type"] = 'OBJECT'
             json_data["matrix"] = [tuple(v) for v in Matrix()]
             
-            self.write_object(json_data, context)
+            objs = self.write_object(json_data, context, version)
+            
+            b = None
         
         wm.clipboard = json.dumps(json_data, separators=(',',':'))
         
         if json_data["type"] == 'OBJECT':
-            objs = json_data["objects"]
             if len(objs) > 1:
-                self.report({'INFO'}, "Copy: {} objects".format(len(objs)))
+                label = "{} objects".format(len(objs))
             else:
-                self.report({'INFO'}, "Copy: {}".format(tuple(objs)[0]))
+                label = "{}".format(tuple(objs)[0])
         else:
-            self.report({'INFO'}, "Copy: {} data".format(json_data["type"]))
+            label = "{} ({} data)".format(context.object.name, json_data["type"])
+        
+        clipboard_history.push(label, json_data, b, opts.history_size,
+            opts.history_memory*1024*1024, opts.codec.lower())
+        
+        self.report({'INFO'}, "Copy: {}".format(label))
         
         return {'FINISHED'}
 
@@ -845,31 +2269,50 @@ class OperatorCopy:
 class OperatorPaste:
     data_types = {'OBJECT', 'MESH', 'CURVE', 'SURFACE', 'META', 'ARMATURE'}
     
+    # Modes in which each data type can be pasted
+    data_type_modes = {
+        'OBJECT':({'OBJECT'}, "To paste objects, you must be in the Object mode"),
+        'MESH':({'OBJECT', 'EDIT_MESH', 'EDIT_CURVE'}, "Mesh data can be pasted only in Object, Edit Mesh and Edit Curve modes"),
+        'CURVE':({'OBJECT', 'EDIT_MESH', 'EDIT_CURVE'}, "Curve data can be pasted only in Object, Edit Mesh and Edit Curve modes"),
+        'SURFACE':({'OBJECT', 'EDIT_SURFACE'}, "Surface data can be pasted only in Object and Edit Surface modes"),
+        'META':({'OBJECT', 'EDIT_MESH', 'EDIT_METABALL'}, "Metaelement data can be pasted only in Object, Edit Mesh and Edit Meta modes"),
+        'ARMATURE':({'OBJECT', 'EDIT_MESH', 'EDIT_ARMATURE'}, "Armature data can be pasted only in Object, Edit Mesh and Edit Armature modes"),
+    }
+    
+    history_index = -1 | -prop() # paste from the clipboard history
+    
     @classmethod
     def poll(cls, context):
         return context.mode in copy_paste_modes
     
     def read_clipboard_object(self, json_data, context):
+        job = json_data.get("job")
+        if job: wait_clipboard_job(str(job))
+        
         self.active_object = json_data.get("active_object", "")
         assert isinstance(self.active_object, str)
         
         active_object_library = json_data.get("active_object_library", "")
         active_object_library = str(active_object_library)
         
-        self.parents = json_data.get("parents", {})
-        assert isinstance(self.parents, dict)
-        for k, v in self.parents.items():
-            assert len(v) == 2
-            assert isinstance(v[0], str) and isinstance(v[1], str)
-        
-        matrices = json_data.get("matrices", {})
-        assert isinstance(matrices, dict)
-        self.matrices = {}
-        for k, v in matrices.items():
-            self.matrices[k] = Matrix(matrices[k])
-        
-        objects = json_data["objects"]
+        if "manifest" in json_data:
+            objects, self.matrices, self.parents = decode_object_manifest(json_data["manifest"])
+        else:
+            self.parents = json_data.get("parents", {})
+            assert isinstance(self.parents, dict)
+            for k, v in self.parents.items():
+                assert len(v) == 2
+                assert isinstance(v[0], str) and isinstance(v[1], str)
+            
+            matrices = json_data.get("matrices", {})
+            assert isinstance(matrices, dict)
+            self.matrices = {}
+            for k, v in matrices.items():
+                self.matrices[k] = Matrix(matrices[k])
+            
+            objects = json_data["objects"]
         assert isinstance(objects, dict) and objects
+        self.objects = objects
         
         libraries = json_data["libraries"]
         assert isinstance(libraries, dict) and libraries
@@ -882,6 +2325,8 @@ class OperatorPaste:
             if not lib_path:
                 continue
             lib_path = os.path.normcase(bpy.path.abspath(lib_path))
+            if is_clipboard_path(lib_path):
+                lib_path = clipboard_store.resolve(lib_path)
             libraries[id] = ("" if lib_path == this_path else lib_path)
         
         self.active_object_library = libraries.get(active_object_library, None)
@@ -896,16 +2341,40 @@ class OperatorPaste:
                 obj_names = set()
                 self.libraries[lib_path] = obj_names
             obj_names.add(obj_name)
+        
+        self.source = str(json_data.get("source", ""))
+        
+        materials = json_data.get("materials", {})
+        assert isinstance(materials, dict)
+        self.materials = {}
+        for id, mat_names in materials.items():
+            assert all(isinstance(mat_name, str) for mat_name in mat_names)
+            self.materials[libraries[str(id)]] = list(mat_names)
     
     def read_clipboard(self, context):
         wm = context.window_manager
         
-        json_data = json.loads(wm.clipboard)
+        if self.history_index >= 0:
+            entry = clipboard_history[self.history_index]
+            json_data = json.loads(entry.json_text)
+            data = entry.data
+        else:
+            json_data = json.loads(wm.clipboard)
+            data = None
         assert json_data["content"] == "Blender 3D-clipboard"
         
+        self.version = json_data.get("version", 1)
+        assert self.version in clipboard_versions
+        
         self.data_type = json_data["type"]
         assert self.data_type in self.data_types
         
+        self.history_data = data
+        
+        return json_data
+    
+    def read_clipboard_data(self, json_data, context):
+        # Only done when the data can actually be pasted
         self.matrix = Matrix(json_data["matrix"])
         assert len(self.matrix) == 4
         
@@ -917,31 +2386,39 @@ class OperatorPaste:
         if self.data_type == 'OBJECT':
             self.read_clipboard_object(json_data, context)
         else:
+            # Set for streamed data (see ChunkStream)
+            self.chunk_index = bool(json_data.get("chunk_index", False))
             try:
                 self.serialized_data = json_data.get("data")
-                if self.serialized_data:
-                    self.serialized_data = decompress_b64(self.serialized_data)
+                if self.history_data is not None:
+                    self.serialized_data = self.history_data
+                elif self.serialized_data:
+                    codec = json_data.get("codec", "bz2")
+                    self.serialized_data = decompress_b64(self.serialized_data, codec)
+                elif "data_ref" in json_data:
+                    self.serialized_data = load_clipboard_blob(json_data["data_ref"])
             except Exception as exc:
                 # TODO: see what actual exceptions can appear
                 print(exc)
                 raise ValueError
-        
-        return json_data
     
-    def add_pivot(self, p, active):
-        p = p.to_3d()
+    def add_pivots(self, co, active_indices):
+        # Adds each point of the flat xyz array to the pivot statistics
+        count = len(co) // 3
+        if count == 0: return
+        p_min, p_max, p_sum, active_sum, active_count = point_stats(co, active_indices)
         if self.pivot_count == 0:
-            self.pivot_min = list(p)
-            self.pivot_max = list(p)
+            self.pivot_min = list(p_min)
+            self.pivot_max = list(p_max)
         else:
             for i in range(3):
-                self.pivot_min[i] = min(self.pivot_min[i], p[i])
-                self.pivot_max[i] = max(self.pivot_max[i], p[i])
-        self.pivot_average += p
-        self.pivot_count += 1
-        if active:
-            self.pivot_active += p
-            self.pivot_active_count += 1
+                self.pivot_min[i] = min(self.pivot_min[i], p_min[i])
+                self.pivot_max[i] = max(self.pivot_max[i], p_max[i])
+        self.pivot_average += Vector(p_sum)
+        self.pivot_count += count
+        if active_count:
+            self.pivot_active += Vector(active_sum)
+            self.pivot_active_count += active_count
     
     def calc_transform(self, context, obj):
         opts = addon.preferences
@@ -956,11 +2433,6 @@ class OperatorPaste:
         return not_local, transform, transform_pivot
     
     def process_object(self, context):
-        if context.mode != 'OBJECT':
-            self.report({'WARNING'},
-                        "To paste objects, you must be in the Object mode")
-            return True
-        
         bpy.ops.object.select_all(action='DESELECT')
         
         opts = addon.preferences
@@ -969,22 +2441,25 @@ class OperatorPaste:
         
         old_to_new = {}
         new_to_old = {}
+        active_obj = None
         
+        # Objects are linked to the scene all at once afterwards
         def add_obj(new_obj, obj_name, lib_path):
-            scene.objects.link(new_obj)
-            
-            new_obj.select = True
+            nonlocal active_obj
             
             if self.active_object_library is not None:
                 if ((obj_name == self.active_object) and
                     (lib_path == self.active_object_library)):
-                        scene.objects.active = new_obj
+                        active_obj = new_obj
             
             old_to_new[obj_name] = new_obj
             new_to_old[new_obj] = obj_name
         
         load = bpy.data.libraries.load
         
+        # source data -> its copy (objects that shared data keep sharing it)
+        data_copies = {}
+        
         for lib_path, obj_names in self.libraries.items():
             if not lib_path:
                 link = not opts.append
@@ -995,31 +2470,74 @@ class OperatorPaste:
                         continue
                     new_obj = obj.copy()
                     if opts.append and obj.data:
-                        new_obj.data = obj.data.copy()
+                        if not opts.share_data:
+                            new_obj.data = obj.data.copy()
+                        else:
+                            data = data_copies.get(obj.data)
+                            if data is None:
+                                data = obj.data.copy()
+                                data_copies[obj.data] = data
+                            new_obj.data = data
                     add_obj(new_obj, obj_name, lib_path)
                 continue
             
-            if not os.path.isfile(lib_path):
+            stat = library_listings.stat(lib_path)
+            if stat is None:
                 continue # report a warning?
             
             link = not (opts.append or is_clipboard_path(lib_path))
             
-            obj_names = list(obj_names)
+            # Objects known to be missing aren't requested (and the
+            # file isn't opened at all if none of them are there)
+            available = library_listings.objects(lib_path, stat)
+            if available is None:
+                obj_names = list(obj_names)
+            else:
+                obj_names = [obj_name for obj_name in obj_names if obj_name in available]
+                if not obj_names: continue
             
+            # Materials are requested explicitly to know which
+            # of the appended materials corresponds to which source
+            mat_names = ([] if link else self.materials.get(lib_path, []))
+            
+            # Listing is updated by the same load() call
             with load(lib_path, link) as (data_from, data_to):
+                library_listings.update(lib_path, stat, data_from.objects)
                 data_to.objects = list(obj_names) # <-- ALWAYS COPY!
+                mat_names = [mat_name for mat_name in mat_names if mat_name in data_from.materials]
+                data_to.materials = list(mat_names)
             
             for i, new_obj in enumerate(data_to.objects):
                 if new_obj is not None:
                     add_obj(new_obj, obj_names[i], lib_path)
+            
+            if opts.share_data:
+                self.reuse_materials(lib_path, mat_names, data_to.materials)
         
-        scene.update()
+        scene_objects = scene.objects
+        for new_obj in new_to_old:
+            scene_objects.link(new_obj)
+            new_obj.select = True
+        if active_obj:
+            scene_objects.active = active_obj
         
         # Restore parent relations (Blender actually adds a relationship
         # if both parent and child are imported, but for some reason
         # the imported parent doesn't affect the imported children.
         # Also, on re-parenting the matrix has to be restored.)
-        for obj, old_name in new_to_old.items():
+        # Setting matrix_world uses the parent's current world matrix,
+        # so parents are processed before children, and the scene
+        # needs to be updated only once, at the end.
+        # Pivot is known before any matrix is set, so the placement
+        # can be applied right away
+        objs = self.parents_first(old_to_new)
+        matrices = [self.matrices[new_to_old[obj]] for obj in objs]
+        co = array('d', [c for matrix in matrices for c in matrix.translation])
+        self.add_pivots(co, [i for i, obj in enumerate(objs) if obj == active_obj])
+        placement = self.calc_placement(context)
+        
+        for obj, matrix in zip(objs, matrices):
+            old_name = new_to_old[obj]
             parent_info = self.parents.get(old_name, None)
             if parent_info:
                 parent = old_to_new.get(parent_info[0])
@@ -1027,10 +2545,11 @@ class OperatorPaste:
                     obj.parent = parent
                     obj.parent_bone = parent_info[1]
             
-            obj.matrix_world = self.matrices[old_name]
-            
-            is_active = (obj == scene.objects.active)
-            self.add_pivot(obj.matrix_world.translation, is_active)
+            if placement is not None:
+                matrix = placement * matrix
+            obj.matrix_world = matrix
+        
+        scene.update()
         
         # In Object mode the coordsystem option is not used
         # (ambiguous and the same effects can be achieved relatively easily)
@@ -1044,11 +2563,43 @@ class OperatorPaste:
                     if obj.users_scene: continue
                     scene.objects.link(obj)
     
-    def process_mesh(self, context, stream):
-        if context.mode not in {'OBJECT', 'EDIT_MESH', 'EDIT_CURVE'}:
-            self.report({'WARNING'}, "Mesh data can be pasted only in Object, Edit Mesh and Edit Curve modes")
-            return True
+    def reuse_materials(self, lib_path, mat_names, new_materials):
+        # Each paste appends the materials again; instead, the ones
+        # appended before (or the originals, if pasting into the same
+        # file) are used, and the new duplicates are removed
+        if not hasattr(bpy.types.ID, "user_remap"): return # since 2.78
+        
+        source = (self.source if is_clipboard_path(lib_path) else lib_path)
+        same_file = (source == clipboard_source_id())
+        materials = bpy.data.materials
         
+        for mat_name, new_mat in zip(mat_names, new_materials):
+            if new_mat is None: continue
+            
+            key = (source, mat_name)
+            mat = materials.get(mat_name if same_file else pasted_materials.get(key, ""))
+            
+            if (mat is None) or mat.library or (mat == new_mat):
+                pasted_materials[key] = new_mat.name
+                continue
+            
+            new_mat.user_remap(mat)
+            materials.remove(new_mat)
+    
+    def parents_first(self, old_to_new):
+        # Pasted objects ordered so that parents precede their children
+        ordered = []
+        visited = set()
+        for old_name in old_to_new:
+            chain = []
+            while (old_name in old_to_new) and (old_name not in visited):
+                visited.add(old_name)
+                chain.append(old_name)
+                old_name = self.parents.get(old_name, ("",))[0]
+            ordered.extend(old_to_new[old_name] for old_name in reversed(chain))
+        return ordered
+    
+    def process_mesh(self, context, stream):
         if context.mode == 'EDIT_CURVE':
             bpy.ops.curve.select_all(action='DESELECT')
             
@@ -1068,8 +2619,9 @@ class OperatorPaste:
                 context.scene.objects.active = obj
                 obj.select = True
                 
-                with ToggleObjectMode('EDIT'):
-                    self.process_mesh_mesh(obj, context, stream)
+                # A brand-new mesh can be built directly, without
+                # going through the edit-mode bmesh
+                self.process_mesh_new(obj, context, stream)
             else:
                 bpy.ops.mesh.select_all(action='DESELECT')
                 
@@ -1079,147 +2631,34 @@ class OperatorPaste:
     def process_mesh_curve(self, obj, context, stream):
         not_local, transform, transform_pivot = self.calc_transform(context, obj)
         
-        iofuncs = def_read_funcs(stream)
-        read = iofuncs["read"]
-        unpack = iofuncs["unpack"]
-        read_str = iofuncs["read_str"]
-        read_H = iofuncs["read_H"]
-        read_I = iofuncs["read_I"]
-        read_bool = iofuncs["read_bool"]
-        read_ddd = iofuncs["read_ddd"]
-        
-        verts = []
-        with ChunkReader(stream, "verts") as chunk:
-            while chunk:
-                verts.append(read_ddd())
-        
-        connections = [[] for v in verts]
-        
-        edges = []
-        with ChunkReader(stream, "edges") as chunk:
-            while chunk:
-                ei = len(edges)
-                vi0 = read_I()
-                connections[vi0].append(ei)
-                vi1 = read_I()
-                connections[vi1].append(ei)
-                edges.append((vi0, vi1))
-                read_bool() # seam
-                read_bool() # smooth
-        
-        faces = []
-        with ChunkReader(stream, "faces") as chunk:
-            while chunk:
-                f = []
-                faces.append(f)
-                n_loops = read_H()
-                for i in range(n_loops):
-                    f.append((read_I(), read_I()))
-                read_H() # material_index
-                read_bool() # smooth
+        geometry = MeshGeometry(stream, self.version)
         
         active_vertex = -1
-        with ChunkReader(stream, "select_history") as chunk:
-            elem_type = read(1)
-            elem_id = read_I()
-            if elem_type == b'V':
+        if geometry.select_history:
+            elem_type, elem_id = geometry.select_history[-1]
+            if elem_type == 'V':
                 active_vertex = elem_id
         
-        used_edges = [False] * len(edges)
-        
-        splines = []
-        cyclic_splines = []
-        
-        for f in faces:
-            spline = []
-            cyclic_splines.append(spline)
-            
-            for vi, ei in f:
-                used_edges[ei] = True
-                spline.append(vi)
-        
-        def other_vert(ei, vi):
-            e = edges[ei]
-            if e[0] == vi:
-                return e[1]
-            elif e[1] == vi:
-                return e[0]
-            return -1
-        
-        def other_edge(vi, ei):
-            c = connections[vi]
-            if len(c) != 2:
-                return -1
-            if c[0] == ei:
-                return c[1]
-            elif c[1] == ei:
-                return c[0]
-            return -1
-        
-        # link non-cyclic edges
-        for vi, c in enumerate(connections):
-            if len(c) == 2:
-                continue
-            
-            vi0 = vi
-            
-            for ei in c:
-                if used_edges[ei]:
-                    continue
-                
-                spline = []
-                splines.append(spline)
-                
-                vi = vi0
-                while True:
-                    spline.append(vi)
-                    if ei == -1:
-                        break
-                    used_edges[ei] = True
-                    vi = other_vert(ei, vi)
-                    ei = other_edge(vi, ei)
-        
-        # link cyclic edges
-        for vi, c in enumerate(connections):
-            if (len(c) != 2) or used_edges[c[0]] or used_edges[c[1]]:
-                continue
-            
-            ei = c[0]
-            
-            spline = []
-            cyclic_splines.append(spline)
-            
-            while True:
-                spline.append(vi)
-                if (ei == -1) or used_edges[ei]:
-                    break
-                used_edges[ei] = True
-                vi = other_vert(ei, vi)
-                ei = other_edge(vi, ei)
+        points, splines = edge_chains(len(geometry.co) // 3, geometry.edge_verts,
+            geometry.loop_totals, geometry.loop_verts, geometry.loop_edges)
         
-        def set_point(point, vi):
-            co = Vector(verts[vi])
-            p = transform_pivot * co
-            self.add_pivot(p, vi == active_vertex)
-            if not_local:
-                co = transform * co
-            point.co = co.to_4d()
-            point.select = True
+        # All points are transformed at once; spline points
+        # are 4D (homogeneous) coordinates
+        co = array_take(geometry.co, points, 3)
+        active_points = [i for i, vi in enumerate(points) if vi == active_vertex]
+        co = self.transform_coords(context, obj, co, not_local, transform, transform_pivot, active_points)
         
-        for s in cyclic_splines:
-            spline = obj.data.splines.new('POLY')
-            spline.use_cyclic_u = True
-            points = spline.points
-            points.add(len(s) - 1)
-            for i, vi in enumerate(s):
-                set_point(points[i], vi)
+        co4 = array('f', [1.0]) * (len(points) * 4)
+        for axis in range(3):
+            co4[axis::4] = array('f', co[axis::3])
         
-        for s in splines:
+        for start, count, cyclic in splines:
             spline = obj.data.splines.new('POLY')
-            points = spline.points
-            points.add(len(s) - 1)
-            for i, vi in enumerate(s):
-                set_point(points[i], vi)
+            spline.use_cyclic_u = cyclic
+            spline_points = spline.points
+            spline_points.add(count - 1)
+            spline_points.foreach_set("co", co4[start*4:(start+count)*4])
+            spline_points.foreach_set("select", [True] * count)
     
     def process_mesh_mesh(self, obj, context, stream):
         not_local, transform, transform_pivot = self.calc_transform(context, obj)
@@ -1273,57 +2712,49 @@ class OperatorPaste:
         deserializers["faces.tex"] = deserializer_tex
         deserializers["faces.freestyle"] = deserializer_freestyle
         
-        if 'EDIT' in obj.mode:
-            bm = bmesh.from_edit_mesh(obj.data)
-        else:
-            bm = bmesh.new()
+        bm = bmesh.from_edit_mesh(obj.data)
         
-        verts = []
-        edges = []
-        faces = []
+        geometry = MeshGeometry(stream, self.version)
         
-        with ChunkReader(stream, "verts") as chunk:
-            while chunk:
-                v = bm.verts.new(read_ddd())
-                verts.append(v)
-                v.select = True
+        active_verts = ()
+        if geometry.select_history:
+            active_verts = geometry.elem_verts(*geometry.select_history[-1])
         
-        with ChunkReader(stream, "edges") as chunk:
-            while chunk:
-                vi0 = read_I()
-                vi1 = read_I()
-                e = bm.edges.new((verts[vi0], verts[vi1]))
-                edges.append(e)
-                e.select = True
-                e.seam = read_bool()
-                e.smooth = read_bool()
+        co = self.transform_coords(context, obj, geometry.co, not_local, transform, transform_pivot, active_verts)
         
-        with ChunkReader(stream, "faces") as chunk:
-            while chunk:
-                f = bm.faces.new(verts[(read_I(), read_I())[0]]
-                                 for i in range(read_H()))
-                faces.append(f)
-                f.select = True
-                f.material_index = read_H()
-                f.smooth = read_bool()
+        verts = [bm.verts.new(v) for v in zip(co[0::3], co[1::3], co[2::3])]
+        for v in verts:
+            v.select = True
         
-        active_verts = ()
+        edges = []
+        edge_verts = geometry.edge_verts
+        for vi0, vi1, seam, smooth in zip(edge_verts[0::2], edge_verts[1::2],
+                                          geometry.edge_seams, geometry.edge_smooth):
+            e = bm.edges.new((verts[vi0], verts[vi1]))
+            edges.append(e)
+            e.select = True
+            e.seam = bool(seam)
+            e.smooth = bool(smooth)
+        
+        faces = []
+        loop_verts = geometry.loop_verts
+        loop_start = 0
+        for loop_total, material_index, smooth in zip(geometry.loop_totals,
+                                                      geometry.face_materials,
+                                                      geometry.face_smooth):
+            loop_end = loop_start + loop_total
+            f = bm.faces.new(verts[vi] for vi in loop_verts[loop_start:loop_end])
+            faces.append(f)
+            f.select = True
+            f.material_index = material_index
+            f.smooth = bool(smooth)
+            loop_start = loop_end
+        
+        elems = {"V":verts, "E":edges, "F":faces}
         
         bm.select_history.clear()
-        with ChunkReader(stream, "select_history") as chunk:
-            while chunk:
-                elem_type = read(1)
-                elem_id = read_I()
-                if elem_type == b'V':
-                    elem = verts[elem_id]
-                    active_verts = (elem,)
-                elif elem_type == b'E':
-                    elem = edges[elem_id]
-                    active_verts = elem.verts
-                elif elem_type == b'F':
-                    elem = faces[elem_id]
-                    active_verts = elem.verts
-                bm.select_history.add(elem)
+        for elem_type, elem_id in geometry.select_history:
+            bm.select_history.add(elems[elem_type][elem_id])
         
         chunk = ChunkReader(stream)
         if chunk.name == "layers":
@@ -1377,54 +2808,178 @@ class OperatorPaste:
                             chunk_layer.skip()
                             continue
                         
+                        if (deserializer == deserializer_deform) and (self.version > 1):
+                            self.apply_deform_csr(elems[seq_type], layer, *read_deform_csr(stream, chunk_layer))
+                            continue
+                        
                         while chunk_layer:
                             for elem in elems[seq_type]:
                                 deserializer(elem, layer)
         
-        for v in verts:
-            # ATTENTION!
-            # Vector can be transformed only via M*V, not V*M!
-            p = transform_pivot * v.co
-            if not_local:
-                v.co = transform * v.co
-            self.add_pivot(p, v in active_verts)
-        
         bm.normal_update()
+    
+    def apply_deform_csr(self, verts, layer, offsets, groups, weights):
+        # Single loop over the flat columns (bmesh has no bulk access
+        # to deform weights); extra entries are ignored
+        dverts = [v[layer] for v in verts]
+        if not dverts: return
+        if not hasattr(dverts[0], "items"): return # Blender supports this since some version
+        offsets = offsets[:len(dverts)+1]
+        counts = array('I', map(operator.sub, offsets[1:], offsets[:-1]))
+        vert_indices = array_repeat(array('I', range(len(counts))), counts)
+        for vi, group_index, weight in zip(vert_indices, groups, weights):
+            dverts[vi][group_index] = weight
+    
+    def process_mesh_new(self, obj, context, stream):
+        not_local, transform, transform_pivot = self.calc_transform(context, obj)
         
-        if 'EDIT' not in obj.mode:
-            bm.to_mesh(obj.data)
-            bm.free()
+        geometry = MeshGeometry(stream, self.version)
+        
+        active_verts = ()
+        if geometry.select_history:
+            active_verts = geometry.elem_verts(*geometry.select_history[-1])
+        
+        co = self.transform_coords(context, obj, geometry.co, not_local, transform, transform_pivot, active_verts)
+        
+        # A new mesh has no custom-data layers, so the rest of
+        # the stream (select history, layers) is irrelevant
+        
+        n_verts = len(co) // 3
+        n_edges = len(geometry.edge_seams)
+        n_loops = len(geometry.loop_verts)
+        n_faces = len(geometry.loop_totals)
+        
+        mesh = obj.data
+        
+        mesh.vertices.add(n_verts)
+        mesh.vertices.foreach_set("co", array_cast(co, 'f'))
+        mesh.vertices.foreach_set("select", array('i', [1]) * n_verts)
+        
+        mesh.edges.add(n_edges)
+        mesh.edges.foreach_set("vertices", array_cast(geometry.edge_verts, 'i'))
+        mesh.edges.foreach_set("use_seam", array_cast(geometry.edge_seams, 'i'))
+        mesh.edges.foreach_set("use_edge_sharp", array_cast(array_not(geometry.edge_smooth), 'i'))
+        mesh.edges.foreach_set("select", array('i', [1]) * n_edges)
+        
+        mesh.loops.add(n_loops)
+        mesh.loops.foreach_set("vertex_index", array_cast(geometry.loop_verts, 'i'))
+        mesh.loops.foreach_set("edge_index", array_cast(geometry.loop_edges, 'i'))
+        
+        mesh.polygons.add(n_faces)
+        mesh.polygons.foreach_set("loop_start", geometry.loop_starts)
+        mesh.polygons.foreach_set("loop_total", array_cast(geometry.loop_totals, 'i'))
+        mesh.polygons.foreach_set("material_index", array_cast(geometry.face_materials, 'i'))
+        mesh.polygons.foreach_set("use_smooth", array_cast(geometry.face_smooth, 'i'))
+        mesh.polygons.foreach_set("select", array('i', [1]) * n_faces)
+        
+        # Indices come from the system clipboard and aren't checked
+        # by foreach_set(); bad ones would leave an invalid mesh
+        if mesh.validate():
+            self.report({'WARNING'}, "Invalid mesh data was corrected")
+        
+        mesh.update()
+    
+    def transform_coords(self, context, obj, co, not_local, transform, transform_pivot, active_verts):
+        # Whole coordinate array is transformed (and added to pivot) at once
+        self.add_pivots(transform_points(co, transform_pivot), active_verts)
+        placement = self.calc_placement(context)
+        if placement is not None:
+            # Placement is in world space
+            matrix_world = obj.matrix_world
+            placement = matrix_world.inverted() * placement * matrix_world
+            if not_local:
+                return transform_points(co, placement * transform)
+            return transform_points(co, placement)
+        if not_local:
+            return transform_points(co, transform)
+        return array_cast(co, 'd')
     
-    def process_curve(self, context):
-        if context.mode not in {'OBJECT', 'EDIT_MESH', 'EDIT_CURVE'}:
-            self.report({'WARNING'}, "Curve data can be pasted only in Object, Edit Mesh and Edit Curve modes")
-            return True
+    def calc_pivot(self):
+        pivot = (Vector(self.pivot_min) + Vector(self.pivot_max)) * 0.5
+        if self.pivot_mode == 'ACTIVE_ELEMENT':
+            if self.pivot_active_count:
+                pivot = self.pivot_active * (1.0 / self.pivot_active_count)
+        elif self.pivot_mode in ('MEDIAN_POINT', 'INDIVIDUAL_ORIGINS'):
+            pivot = self.pivot_average * (1.0 / self.pivot_count)
+        elif self.pivot_mode == 'CURSOR':
+            pivot = self.cursor
+        return pivot
     
-    def process_surface(self, context):
-        if context.mode not in {'OBJECT', 'EDIT_SURFACE'}:
-            self.report({'WARNING'}, "Surface data can be pasted only in Object and Edit Surface modes")
-            return True
+    def calc_placement(self, context):
+        # Moving to cursor, aligning to view and moving to mouse are
+        # composed into one world-space matrix, which is baked into the
+        # pasted data (instead of invoking a transform operator for each).
+        # Returns None if there's nothing to place.
+        if (not self.place) or (self.pivot_count == 0): return None
+        
+        opts = addon.preferences
+        
+        pivot = self.calc_pivot()
+        placement = Matrix()
+        
+        if opts.paste_at_cursor:
+            v3d = context.space_data
+            cursor = v3d.cursor_location
+            placement = Matrix.Translation(cursor - pivot) * placement
+            pivot = cursor.copy()
+        
+        # Rotation around individual origins can't be expressed with
+        # a single matrix; execute() uses the rotate operator for it
+        if opts.align_to_view and (self.pivot_mode != 'INDIVIDUAL_ORIGINS'):
+            view = get_view_rotation(context)
+            dq = view * self.view.inverted()
+            rotation = dq.to_matrix().to_4x4()
+            placement = (Matrix.Translation(pivot) * rotation *
+                Matrix.Translation(-pivot) * placement)
+        
+        if opts.move_to_mouse and hasattr(self, "mouse_coord"):
+            region = context.region
+            rv3d = context.region_data
+            coord = self.mouse_coord
+            dest = region_2d_to_location_3d(region, rv3d, coord, pivot)
+            placement = Matrix.Translation(dest - pivot) * placement
+        
+        return placement
+    
+    # Mode checks for all data types are done in execute()
+    # (see data_type_modes); these types aren't supported yet
+    
+    def process_curve(self, context, stream):
+        pass
     
-    def process_meta(self, context):
-        if context.mode not in {'OBJECT', 'EDIT_MESH', 'EDIT_METABALL'}:
-            self.report({'WARNING'}, "Metaelement data can be pasted only in Object, Edit Mesh and Edit Meta modes")
-            return True
+    def process_surface(self, context, stream):
+        pass
     
-    def process_armature(self, context):
-        if context.mode not in {'OBJECT', 'EDIT_MESH', 'EDIT_ARMATURE'}:
-            self.report({'WARNING'}, "Armature data can be pasted only in Object, Edit Mesh and Edit Armature modes")
-            return True
+    def process_meta(self, context, stream):
+        pass
+    
+    def process_armature(self, context, stream):
+        pass
     
     def execute(self, context):
+        # Check the header first: there's no need to decode
+        # the data if it can't be pasted in this mode anyway
         try:
             json_data = self.read_clipboard(context)
         except (TypeError, KeyError, ValueError, AssertionError):
             self.report({'WARNING'}, "Incompatible format of clipboard data")
             return {'CANCELLED'}
         
+        modes, message = self.data_type_modes[self.data_type]
+        if context.mode not in modes:
+            self.report({'WARNING'}, message)
+            return {'CANCELLED'}
+        
+        try:
+            self.read_clipboard_data(json_data, context)
+        except (TypeError, KeyError, ValueError, AssertionError):
+            self.report({'WARNING'}, "Incompatible format of clipboard data")
+            return {'CANCELLED'}
+        
         opts = addon.preferences
         
         pivot_mode = context.space_data.pivot_point
+        self.pivot_mode = pivot_mode
         self.pivot_count = 0
         self.pivot_min = None
         self.pivot_max = None
@@ -1432,6 +2987,13 @@ class OperatorPaste:
         self.pivot_active = Vector()
         self.pivot_active_count = 0
         
+        # Linked objects can't be moved; elements always can
+        if self.data_type == 'OBJECT':
+            do_transform = opts.append or ("" in self.libraries)
+        else:
+            do_transform = True
+        self.place = is_view3d(context) and do_transform
+        
         bpy.ops.ed.undo_push(message="Before Paste")
         
         if self.data_type == 'OBJECT':
@@ -1442,10 +3004,9 @@ class OperatorPaste:
             handler = getattr(self, "process_" + self.data_type.lower())
             
             if self.serialized_data:
-                stream = io.BytesIO(self.serialized_data)
+                stream = BufferStream(self.serialized_data, self.chunk_index)
             else:
-                stream = open(data_clipboard_path(), "rb")
-                #stream = io.BufferedReader(stream)
+                stream = BufferStream.open(data_clipboard_path())
             
             if handler(context, stream):
                 stream.close()
@@ -1472,41 +3033,18 @@ class OperatorPaste:
             #bpy.ops.ed.undo()
             return {'CANCELLED'}
         
-        pivot = (Vector(self.pivot_min) + Vector(self.pivot_max)) * 0.5
-        if pivot_mode == 'ACTIVE_ELEMENT':
-            if self.pivot_active_count:
-                pivot = self.pivot_active * (1.0 / self.pivot_active_count)
-        elif pivot_mode in ('MEDIAN_POINT', 'INDIVIDUAL_ORIGINS'):
-            pivot = self.pivot_average * (1.0 / self.pivot_count)
-        elif pivot_mode == 'CURSOR':
-            pivot = self.cursor
-        
-        do_transform = opts.append or ("" in self.libraries)
-        
-        if is_view3d(context) and do_transform:
-            if opts.paste_at_cursor:
-                v3d = context.space_data
-                cursor = v3d.cursor_location
-                bpy.ops.transform.translate(value=(cursor - pivot), proportional='DISABLED')
-                pivot = cursor
-            
-            if opts.align_to_view:
-                view = get_view_rotation(context)
-                dq = view * self.view.inverted()
-                axis, angle = dq.to_axis_angle()
-                bpy.ops.transform.rotate('EXEC_SCREEN', value=angle, axis=axis, proportional='DISABLED')
-            
-            if opts.move_to_mouse:
-                region = context.region
-                rv3d = context.region_data
-                coord = self.mouse_coord
-                dest = region_2d_to_location_3d(region, rv3d, coord, pivot)
-                bpy.ops.transform.translate(value=(dest - pivot), proportional='DISABLED')
+        # Placement was baked into the pasted data, except for
+        # the rotation around individual origins
+        if self.place and opts.align_to_view and (pivot_mode == 'INDIVIDUAL_ORIGINS'):
+            view = get_view_rotation(context)
+            dq = view * self.view.inverted()
+            axis, angle = dq.to_axis_angle()
+            bpy.ops.transform.rotate('EXEC_SCREEN', value=angle, axis=axis, proportional='DISABLED')
         
         bpy.ops.ed.undo_push(message="Paste")
         
         if json_data["type"] == 'OBJECT':
-            objs = json_data["objects"]
+            objs = self.objects
             if len(objs) > 1:
                 self.report({'INFO'}, "Paste: {} objects".format(len(objs)))
             else:
@@ -1523,50 +3061,88 @@ class OperatorPaste:
         self.mouse_coord = Vector((event.mouse_region_x, event.mouse_region_y))
         return self.execute(context)
 
+@addon.Operator(idname="view3d.paste_history", label="Paste from history", description="Paste objects/elements copied earlier")
+class OperatorPasteHistory:
+    index = 0 | prop("Clipboard history entry (0 is the most recent)", "Index", min=0)
+    
+    @classmethod
+    def poll(cls, context):
+        return bpy.ops.view3d.paste.poll()
+    
+    def invoke(self, context, event):
+        if self.index >= len(clipboard_history):
+            return {'CANCELLED'}
+        
+        # Buttons are in the toolbar, but paste needs the 3D view region
+        override = context.copy()
+        for region in context.area.regions:
+            if region.type == 'WINDOW':
+                override["region"] = region
+                override["region_data"] = region.data
+                break
+        
+        return bpy.ops.view3d.paste(override, 'INVOKE_DEFAULT', history_index=self.index)
+
 @addon.Operator(idname="view3d.cut", label="Cut objects/elements", description="Cut objects/elements")
 class OperatorCut:
     @classmethod
     def poll(cls, context):
         return bpy.ops.view3d.copy.poll()
     
+    def cut_mesh(self, bm):
+        # Removes selected vertices that have no unselected edges/faces,
+        # selected edges that have no unselected faces, and selected faces.
+        # Elements used by unselected ones are found in one pass, and
+        # each kind is removed by one bmesh.ops.delete() call.
+        keep_verts = set()
+        keep_edges = set()
+        for f in bm.faces:
+            if not f.select:
+                keep_verts.update(f.verts)
+                keep_edges.update(f.edges)
+        for e in bm.edges:
+            if not e.select:
+                keep_verts.update(e.verts)
+        
+        faces = [f for f in bm.faces if f.select]
+        edges = [e for e in bm.edges if e.select and (e not in keep_edges)]
+        verts = [v for v in bm.verts if v.select and (v not in keep_verts)]
+        
+        self.delete_elements(bm, verts, edges, faces)
+    
+    def cut_mesh_masks(self, bm, vert_mask, edge_mask, face_mask):
+        # Same as cut_mesh(), but with precomputed masks (in mesh order)
+        for seq in (bm.verts, bm.edges, bm.faces):
+            if hasattr(seq, "ensure_lookup_table"): seq.ensure_lookup_table() # since 2.73
+        
+        verts = [bm.verts[i] for i in array_indices(vert_mask)]
+        edges = [bm.edges[i] for i in array_indices(edge_mask)]
+        faces = [bm.faces[i] for i in array_indices(face_mask)]
+        
+        self.delete_elements(bm, verts, edges, faces)
+    
+    def delete_elements(self, bm, verts, edges, faces):
+        # Contexts: 3 = only faces, 2 = edges (and their faces),
+        # 1 = vertices (and their edges/faces)
+        bmesh.ops.delete(bm, geom=faces, context=3)
+        bmesh.ops.delete(bm, geom=edges, context=2)
+        bmesh.ops.delete(bm, geom=verts, context=1)
+    
     def execute(self, context):
         bpy.ops.ed.undo_push(message="Before Cut")
-        bpy.ops.view3d.copy(force_copy=True)
+        bpy.ops.view3d.copy(force_copy=True, keep_snapshot=True)
+        snapshot = take_cut_snapshot()
         
         if 'EDIT' in context.mode:
             obj = bpy.context.object
             
             if obj.type == 'MESH':
                 bm = bmesh.from_edit_mesh(obj.data)
-                
-                for v in bm.verts:
-                    if v.select:
-                        can_remove = True
-                        for e in v.link_edges:
-                            if not e.select:
-                                can_remove = False
-                                break
-                        if can_remove:
-                            for f in v.link_faces:
-                                if not f.select:
-                                    can_remove = False
-                                    break
-                            if can_remove:
-                                bm.verts.remove(v)
-                
-                for e in bm.edges:
-                    if e.select:
-                        can_remove = True
-                        for f in e.link_faces:
-                            if not f.select:
-                                can_remove = False
-                                break
-                        if can_remove:
-                            bm.edges.remove(e)
-                
-                for f in bm.faces:
-                    if f.select:
-                        bm.faces.remove(f)
+                if snapshot and (snapshot.mesh == obj.data):
+                    self.cut_mesh_masks(bm, *snapshot.cut_masks())
+                else:
+                    self.cut_mesh(bm)
+                bmesh.update_edit_mesh(obj.data)
         else:
             # Maybe just use Delete operator? (if it doesn't create Undo entry)
             for obj in list(context.selected_objects):
@@ -1596,6 +3172,24 @@ class ThisAddonPreferences:
     ])
     
     force_copy = True | prop("Always save clipbuffer to disk", "Force full copy")
+    codec = 'AUTO' | prop("Compression of the element data copied to the system clipboard", "Compression", items=[
+        ('AUTO', "Auto", "Choose by data size (small data is not compressed)"),
+        ('NONE', "None", "No compression"),
+        ('ZLIB', "Zlib", "Fast compression"),
+        ('LZMA', "LZMA", "Better compression (if LZMA is available)"),
+        ('BZ2', "BZ2", "Slow compression (used by older versions)"),
+    ])
+    external_file_threshold = 1024 | prop("Element data bigger than this (in KiB) is passed via a file instead of the system clipboard", "File threshold", min=0)
+    full_file_copy = False | prop("Save the whole .blend file when copying objects, instead of only the copied objects and their dependencies", "Copy whole file")
+    share_data = True | prop("When pasting, objects that shared data (or materials) keep sharing it, instead of getting separate copies", "Keep shared data")
+    history_size = 10 | prop("Number of clipboards kept in the history", "History size", min=1)
+    history_memory = 64 | prop("Element data of older clipboards is moved to disk when the history exceeds this size (in MiB)", "History memory", min=0)
+    store_size = 1024 | prop("Clipboard files are removed (least recently used first) when their total size exceeds this limit (in MiB)", "Clipboard store size", min=0)
+    store_keep = 10 | prop("Number of the most recent clipboards that are never removed", "Keep clipboards", min=1)
+    compress_file = False | prop("Compress the clipboard .blend file (in background)", "Compress file")
+    streaming = False | prop("Compress element data while copying, without keeping it all in memory (always passed via a file)", "Streaming copy")
+    quantize_weights = False | prop("Copy vertex weights with half precision (smaller clipboard)", "Compact weights")
+    legacy_format = False | prop("Copy elements in the old (v1) clipboard format, readable by older versions of the addon", "Legacy format")
     
     def actual_coordsystem(self, context=None):
         if self.coordinate_system == 'CONTEXT':
@@ -1606,6 +3200,18 @@ class ThisAddonPreferences:
     def draw(self, context):
         layout = NestedLayout(self.layout)
         layout.prop(self, "force_copy")
+        layout.prop(self, "full_file_copy")
+        layout.prop(self, "share_data")
+        layout.prop(self, "compress_file")
+        layout.prop(self, "history_size")
+        layout.prop(self, "history_memory")
+        layout.prop(self, "store_size")
+        layout.prop(self, "store_keep")
+        layout.prop(self, "codec")
+        layout.prop(self, "external_file_threshold")
+        layout.prop(self, "streaming")
+        layout.prop(self, "quantize_weights")
+        layout.prop(self, "legacy_format")
 
 def register():
     addon.register()